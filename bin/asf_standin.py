@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+'''
+Local stand-in for the ASF search API (api.daac.asf.alaska.edu) serving
+synthetic Sentinel-1 inventories, for benchmarks and offline testing
+
+Responds to /services/search/param with output=json, csv or kml, honoring
+platform, start, end, relativeOrbit, flightDirection and polarization.
+intersectsWith is ignored (every synthetic scene matches). Optional latency
+and random server errors mimic a slow or flaky API. Responses carry an ETag
+and If-None-Match is answered with 304 Not Modified, like a caching proxy.
+With -d, files in a directory are also served at /files/<name> with
+support for single byte range requests (including suffix ranges
+'bytes=-N'), for testing download_manager.py and partial_safe.py
+
+Examples:
+asf_standin.py -n 10000 -p 8080 -l 0.5 -e 0.1
+asf_standin.py -d ./fake_slcs
+export ASF_URL=http://localhost:8080/services/search/param
+get_inventory_asf.py -r 44.0 44.5 -122.0 -121.5
+'''
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='asf_standin.py')
+    parser.add_argument('-n', type=int, dest='nscenes', required=False,
+            default=10000,
+            help='Number of synthetic scenes')
+    parser.add_argument('-t', type=int, dest='tracks', required=False,
+            default=50,
+            help='Number of relative orbits')
+    parser.add_argument('-p', type=int, dest='port', required=False,
+            default=8080,
+            help='Port to listen on')
+    parser.add_argument('-l', type=float, dest='latency', required=False,
+            default=0,
+            help='Delay before each response [seconds]')
+    parser.add_argument('-e', type=float, dest='errors', required=False,
+            default=0,
+            help='Fraction of requests answered with HTTP 503')
+    parser.add_argument('-d', type=str, dest='directory', required=False,
+            help='Also serve files in this directory at /files/')
+
+    return parser.parse_args()
+
+
+def synthetic_scenes(nscenes=100000, ntracks=50, seed=0):
+    '''
+    List of fake ASF scene dictionaries with realistic fields and formats
+    '''
+    rng = np.random.RandomState(seed)
+    start = pd.Timestamp('2014-10-03').value // 10**9
+    stop = pd.Timestamp('2018-01-01').value // 10**9
+    seconds = rng.randint(start, stop, nscenes)
+    times = pd.to_datetime(seconds, unit='s')
+    orbits = rng.randint(1, 176, ntracks)[rng.randint(0, ntracks, nscenes)]
+    sats = np.where(rng.rand(nscenes) > 0.5, 'A', 'B')
+    lon = rng.uniform(-180, 175, nscenes)
+    lat = rng.uniform(-75, 75, nscenes)
+    sizes = rng.randint(3500 * 2**20, 5000 * 2**20, nscenes, dtype=np.int64)
+    ascending = orbits % 2 == 0
+
+    meta = []
+    for i in range(nscenes):
+        t0 = times[i].strftime('%Y%m%dT%H%M%S')
+        t1 = (times[i] + pd.Timedelta(seconds=27)).strftime('%Y%m%dT%H%M%S')
+        granule = 'S1{0}_IW_SLC__1SDV_{1}_{2}_{3:06d}_{4:06X}_{5:04X}'.format(
+                   sats[i], t0, t1, i % 999999, i, i % 65536)
+        x, y = lon[i], lat[i]
+        footprint = 'POLYGON(({0:.4f} {1:.4f},{2:.4f} {1:.4f},{2:.4f} {3:.4f},{0:.4f} {3:.4f},{0:.4f} {1:.4f}))'.format(
+                     x, y, x + 2.5, y + 1.7)
+        meta.append(dict(granuleName=granule,
+                         fileName=granule + '.zip',
+                         downloadUrl='https://datapool.asf.alaska.edu/SLC/S{}/{}.zip'.format(
+                                     sats[i], granule),
+                         platform='Sentinel-1{}'.format(sats[i]),
+                         sceneDate=times[i].strftime('%Y-%m-%d %H:%M:%S'),
+                         processingDate=(times[i] + pd.Timedelta(hours=3)).strftime('%Y-%m-%d %H:%M:%S'),
+                         relativeOrbit=str(orbits[i]),
+                         absoluteOrbit=str(i % 30000),
+                         frameNumber=str(i % 1200),
+                         flightDirection='ASCENDING' if ascending[i] else 'DESCENDING',
+                         beamMode='IW',
+                         processingLevel='SLC',
+                         polarization='VV+VH',
+                         bytes=str(sizes[i]),
+                         sizeMB='{:.2f}'.format(sizes[i] / 2**20),
+                         md5sum=hashlib.md5(granule.encode()).hexdigest(),
+                         stringFootprint=footprint))
+    return meta
+
+
+def search(scenes, params):
+    '''
+    Scenes matching ASF search parameters {name: value}
+    '''
+    matches = scenes
+    if 'platform' in params:
+        matches = [s for s in matches if s['platform'] == params['platform']]
+    if 'start' in params:
+        start = str(pd.to_datetime(params['start'].replace('UTC', '')))
+        matches = [s for s in matches if s['sceneDate'] >= start]
+    if 'end' in params:
+        end = str(pd.to_datetime(params['end'].replace('UTC', '')))
+        matches = [s for s in matches if s['sceneDate'] <= end]
+    if 'relativeOrbit' in params:
+        orbits = params['relativeOrbit'].split(',')
+        matches = [s for s in matches if s['relativeOrbit'] in orbits]
+    if 'flightDirection' in params:
+        matches = [s for s in matches
+                   if s['flightDirection'].startswith(params['flightDirection'][0])]
+    if 'polarization' in params:
+        matches = [s for s in matches if s['polarization'] == params['polarization']]
+    return matches
+
+
+def to_csv(scenes):
+    ''' ASF-style CSV response '''
+    columns = [('Granule Name', 'granuleName'), ('Platform', 'platform'),
+               ('Beam Mode', 'beamMode'), ('Path Number', 'relativeOrbit'),
+               ('Frame Number', 'frameNumber'), ('Acquisition Date', 'sceneDate'),
+               ('Processing Level', 'processingLevel'), ('Size (MB)', 'sizeMB'),
+               ('Ascending or Descending?', 'flightDirection'), ('URL', 'downloadUrl')]
+    f = io.StringIO()
+    writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+    writer.writerow([name for name, key in columns])
+    for scene in scenes:
+        writer.writerow([scene[key] for name, key in columns])
+    return f.getvalue()
+
+
+def to_kml(scenes):
+    ''' ASF-style KML response with one placemark per footprint '''
+    placemarks = []
+    for scene in scenes:
+        coords = scene['stringFootprint'][len('POLYGON(('):-2].split(',')
+        coords = ' '.join(c.replace(' ', ',') for c in coords)
+        placemarks.append('<Placemark><name>{}</name><Polygon><outerBoundaryIs>'
+                          '<LinearRing><coordinates>{}</coordinates></LinearRing>'
+                          '</outerBoundaryIs></Polygon></Placemark>'.format(
+                           scene['granuleName'], coords))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+            + ''.join(placemarks) + '</Document></kml>')
+
+
+def parse_range(byteRange, size):
+    '''
+    (start, stop) for a single 'bytes=first-last' or 'bytes=-suffix'
+    range header, None if it can't be satisfied
+    '''
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', byteRange.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # last N bytes
+        start, stop = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    if start >= stop:
+        return None
+    return start, stop
+
+
+def make_handler(scenes, latency=0, errors=0, directory=None):
+    '''
+    Request handler class serving the given synthetic scenes
+    (and files in directory)
+    '''
+    class ASFHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            isFile = directory and url.path.startswith('/files/')
+            if url.path != '/services/search/param' and not isFile:
+                self.send_error(404)
+                return
+            time.sleep(latency)
+            if random.random() < errors:
+                self.send_error(503, 'Injected error')
+                return
+            if isFile:
+                self.send_file(os.path.join(directory, os.path.basename(url.path)))
+                return
+            params = {k:v[0] for k,v in parse_qs(url.query).items()}
+            matches = search(scenes, params)
+            output = params.get('output', 'json')
+            if output == 'csv':
+                body, ctype = to_csv(matches), 'text/csv'
+            elif output == 'kml':
+                body, ctype = to_kml(matches), 'application/vnd.google-earth.kml+xml'
+            else:
+                body, ctype = json.dumps([matches]), 'application/json'
+            body = body.encode()
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_file(self, path):
+            ''' Whole file, or a single byte range (416 if unsatisfiable) '''
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            size = os.path.getsize(path)
+            start, stop = 0, size
+            byteRange = self.headers.get('Range')
+            if byteRange:
+                byteRange = parse_range(byteRange, size)
+                if byteRange is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */{}'.format(size))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, stop = byteRange
+                self.send_response(206)
+                self.send_header('Content-Range',
+                                 'bytes {}-{}/{}'.format(start, stop - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(stop - start))
+            self.end_headers()
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    block = f.read(min(2**20, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ASFHandler
+
+
+def serve(scenes, port=0, latency=0, errors=0, directory=None):
+    '''
+    Start stand-in server in a background thread, returns (server, url)
+    port=0 picks a free port. files in directory are served at /files/
+    '''
+    server = ThreadingHTTPServer(('localhost', port),
+                                 make_handler(scenes, latency, errors, directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://localhost:{}/services/search/param'.format(server.server_address[1])
+    return server, url
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    print('Generating {} synthetic scenes...'.format(args.nscenes))
+    scenes = synthetic_scenes(args.nscenes, args.tracks)
+    server = ThreadingHTTPServer(('localhost', args.port),
+                                 make_handler(scenes, args.latency, args.errors,
+                                              args.directory))
+    print('Serving ASF stand-in: http://localhost:{}/services/search/param'.format(args.port))
+    if args.directory:
+        print('Serving {}: http://localhost:{}/files/'.format(args.directory, args.port))
+    server.serve_forever()
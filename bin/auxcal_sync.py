@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+'''
+Download only the Sentinel-1 AUX_CAL files the selected scenes need
+
+The aux_cal listing is crawled at most once per ttl (default a day) and
+recorded, with the files already downloaded, in auxcal_manifest.json in
+the aux directory ($AUXCAL). Each scene needs the calibration file for its
+platform with the latest validity start before the acquisition, generated
+before the scene was processed (IPF processingDate) when known. Only
+missing files are fetched, so jobs sharing one aux directory (e.g. a
+mounted volume for containers) don't re-crawl or re-download, and -o
+links the files into a job directory
+
+Examples:
+auxcal_sync.py -g S1A_IW_SLC__1SDV_20170927T014703_20170927T014730_018548_01F42A_66E6
+auxcal_sync.py -i download-manifest.csv -a /mnt/auxcal -o .
+'''
+import argparse
+import fcntl
+import json
+import os
+import re
+import time
+import pandas as pd
+
+from download_manager import download_all, make_job, read_manifest
+from http_cache import list_links, write_atomic
+from slc_cache import link
+
+AUXCAL_URL = 'https://s1qc.asf.alaska.edu/aux_cal'
+AUXCAL_TTL = 24*3600
+AUX_NAME = re.compile(r'(S1[AB])_AUX_CAL_V(\d{8}T\d{6})_G(\d{8}T\d{6})')
+SLC_NAME = re.compile(r'S1[AB]_IW_SLC__\w{4}_\d{8}T\d{6}_\d{8}T\d{6}')
+TIME_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='auxcal_sync.py')
+    parser.add_argument('-g', type=str, nargs='+', dest='granules', required=False,
+            help='Granule name(s) to get AUX_CAL files for')
+    parser.add_argument('-i', type=str, dest='input', required=False,
+            help='Scenes from download manifest or list of urls')
+    parser.add_argument('-a', type=str, dest='auxdir', required=False,
+            default=os.environ.get('AUXCAL', '.'),
+            help='Shared auxiliary file directory')
+    parser.add_argument('-o', type=str, dest='outdir', required=False,
+            help='Also link needed files into this directory')
+    parser.add_argument('-t', type=float, dest='ttl', required=False,
+            default=AUXCAL_TTL,
+            help='Seconds before aux_cal listing is crawled again')
+
+    return parser.parse_args()
+
+
+def load_manifest(auxdir):
+    ''' Listing and downloaded files recorded in auxdir '''
+    path = os.path.join(auxdir, 'auxcal_manifest.json')
+    if os.path.isfile(path):
+        with open(path) as f:
+            return json.load(f)
+    return dict(checked=0, listing={}, local={})
+
+
+def save_manifest(auxdir, manifest):
+    ''' Atomic write, other jobs may be reading it '''
+    write_atomic(os.path.join(auxdir, 'auxcal_manifest.json'),
+                 json.dumps(manifest, indent=1), 'w')
+
+
+def refresh_listing(manifest, url=AUXCAL_URL, ttl=AUXCAL_TTL):
+    '''
+    Crawl aux_cal listing into manifest if older than ttl
+    '''
+    if time.time() - manifest['checked'] < ttl:
+        return manifest
+    try:
+        links = list_links(url, ttl=ttl, depth=2, suffix='SAFE')
+        manifest['listing'] = {os.path.basename(link): link for link in links}
+        manifest['checked'] = time.time()
+    except Exception as e:
+        if not manifest['listing']:
+            raise
+        print('Using previous aux_cal listing: ', e)
+    return manifest
+
+
+def aux_table(listing):
+    ''' Satellite, validity start and generation time of each aux file '''
+    rows = []
+    for name in listing:
+        match = AUX_NAME.search(name)
+        if match:
+            rows.append((name,) + match.groups())
+    df = pd.DataFrame(rows, columns=['auxFile', 'satellite', 'validity', 'generation'])
+    df['validity'] = pd.to_datetime(df.validity, format=TIME_FORMAT)
+    df['generation'] = pd.to_datetime(df.generation, format=TIME_FORMAT)
+    return df
+
+
+def needed_aux(table, granules, processingDates=None):
+    '''
+    AUX_CAL file for each granule: latest validity start before sensing
+    start, preferring files generated before the scene was processed
+    returns Series granuleName -> auxFile
+    '''
+    granules = pd.Series(granules, dtype=object).reset_index(drop=True)
+    scenes = pd.DataFrame({'granuleName': granules,
+                           'satellite': granules.str[:3],
+                           'sensingStart': pd.to_datetime(granules.str[17:32], format=TIME_FORMAT)})
+    if processingDates is not None:
+        processed = pd.to_datetime(pd.Series(processingDates).values, utc=True, errors='coerce')
+        scenes['processed'] = processed.tz_localize(None)
+    else:
+        scenes['processed'] = pd.NaT
+    df = scenes.merge(table, on='satellite')
+    df = df.loc[df.validity <= df.sensingStart].copy()
+    # unknown processing date counts as after every generation
+    df['predates'] = df.processed.isnull() | (df.generation <= df.processed)
+    df.sort_values(['predates', 'validity', 'generation'], inplace=True)
+    needed = df.groupby('granuleName').auxFile.last()
+    missing = set(granules).difference(needed.index)
+    if missing:
+        print('WARNING: no AUX_CAL file for', ', '.join(sorted(missing)))
+    return needed
+
+
+def sync_auxcal(granules, processingDates=None, auxdir='.', outdir=None,
+                url=AUXCAL_URL, ttl=AUXCAL_TTL):
+    '''
+    Make sure auxdir has the AUX_CAL files for granules, downloading only
+    missing ones. returns local paths (links in outdir if given)
+    '''
+    os.makedirs(auxdir, exist_ok=True)
+    # NOTE: lock so jobs sharing auxdir crawl & download once
+    with open(os.path.join(auxdir, '.auxcal.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = refresh_listing(load_manifest(auxdir), url, ttl)
+        needed = needed_aux(aux_table(manifest['listing']), granules, processingDates)
+        auxFiles = sorted(set(needed))
+        missing = [name for name in auxFiles
+                   if not os.path.isfile(os.path.join(auxdir, name))]
+        if missing:
+            print('Downloading {} of {} AUX_CAL files'.format(len(missing), len(auxFiles)))
+            jobs = [make_job(manifest['listing'][name]) for name in missing]
+            download_all(jobs, auxdir)
+        for name in auxFiles:
+            manifest['local'][name] = dict(url=manifest['listing'][name],
+                                           bytes=os.path.getsize(os.path.join(auxdir, name)),
+                                           used=time.time())
+        save_manifest(auxdir, manifest)
+
+    paths = [os.path.join(auxdir, name) for name in auxFiles]
+    if outdir and os.path.abspath(outdir) != os.path.abspath(auxdir):
+        paths = [link(path, outdir) for path in paths]
+    return paths
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    granules = list(args.granules or [])
+    if args.input:
+        for url, size, md5 in read_manifest(args.input):
+            match = SLC_NAME.search(os.path.basename(url))
+            if match:
+                granules.append(match.group(0))
+    for path in sync_auxcal(granules, auxdir=args.auxdir, outdir=args.outdir, ttl=args.ttl):
+        print(path)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''
+Benchmark the inventory pipeline with synthetic ASF inventories
+
+Times and memory-profiles (tracemalloc peak) each stage of
+get_inventory_asf.py: query (against a local asf_standin.py server),
+load_asf_json, merge_inventories, the inventory store path the script
+uses (update_store, then load_store & load_store_inventory), summaries
+and save_inventory.
+With -c, compares row-by-row parsing (shapely.wkt.loads and strftime
+lambdas) with the vectorized scenes2gf() instead
+
+Examples:
+benchmark_inventory.py -n 1000 10000 100000
+benchmark_inventory.py -n 100000 -c
+'''
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+import geopandas as gpd
+import shapely.wkt
+
+import get_inventory_asf as asf
+import http_cache
+from asf_standin import synthetic_scenes, serve
+from inventory import summarize_dates, summarize_tracks
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='benchmark_inventory.py')
+    parser.add_argument('-n', type=int, nargs='+', dest='nscenes', required=False,
+            default=[1000, 10000, 100000],
+            help='Number(s) of synthetic scenes')
+    parser.add_argument('-t', type=int, dest='tracks', required=False,
+            default=50,
+            help='Number of relative orbits')
+    parser.add_argument('-c', action='store_true', default=False, dest='compare', required=False,
+            help='Compare row-by-row and vectorized parsing only')
+
+    return parser.parse_args()
+
+
+def legacy_scenes2gf(meta):
+    ''' Original row-by-row conversion from get_inventory_asf.py '''
+    df = pd.DataFrame(meta)
+    polygons = df.stringFootprint.apply(shapely.wkt.loads)
+    gf = gpd.GeoDataFrame(df,
+                          crs={'init': 'epsg:4326'},
+                          geometry=polygons)
+
+    gf['timeStamp'] = pd.to_datetime(gf.sceneDate, format='%Y-%m-%d %H:%M:%S')
+    gf['sceneDateString'] = gf.timeStamp.apply(lambda x: x.strftime('%Y-%m-%d'))
+    gf['dateStamp'] = pd.to_datetime(gf.sceneDateString)
+    gf['utc'] = gf.timeStamp.apply(lambda x: x.strftime('%H:%M:%S'))
+    gf['orbitCode'] = gf.relativeOrbit.astype('category').cat.codes
+
+    return gf
+
+
+def timeit(func, *args):
+    ''' Return (seconds, result) for a single call '''
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def profile(func, *args):
+    '''
+    Return (seconds, peak MB, result). Memory is measured in a second call,
+    since tracemalloc slows everything down
+    '''
+    seconds, result = timeit(func, *args)
+    tracemalloc.start()
+    func(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1e6, result
+
+
+def query_uncached(*args):
+    ''' query_asf_windows with an empty response cache '''
+    http_cache.CACHE_DIR = tempfile.mkdtemp(dir=os.getcwd())
+    return asf.query_asf_windows(*args)
+
+
+def store_update(*queryFiles):
+    ''' update_store from query files into an empty store, then save_store '''
+    store = dict(query={}, scenes={})
+    for queryFile in queryFiles:
+        asf.update_store(store, queryFile)
+    asf.save_store(store, 'benchmark_store.json')
+    return store
+
+
+def store_inventory(storefile):
+    ''' load_store & load_store_inventory, as in get_inventory_asf.py '''
+    return asf.load_store_inventory(asf.load_store({}, storefile))
+
+
+def compare_parsers(nscenes, ntracks):
+    '''
+    Check row-by-row and vectorized parsing agree and report speedup
+    '''
+    print('Generating {} synthetic scenes...'.format(nscenes))
+    meta = synthetic_scenes(nscenes, ntracks)
+    tLegacy, gfLegacy = timeit(legacy_scenes2gf, meta)
+    tFast, gfFast = timeit(asf.scenes2gf, meta)
+    pd.testing.assert_frame_equal(pd.DataFrame(gfLegacy.drop(columns='geometry')),
+                                  pd.DataFrame(gfFast.drop(columns='geometry')))
+    assert gfLegacy.geometry.geom_equals(gfFast.geometry).all()
+    print('row-by-row: {:.2f} s'.format(tLegacy))
+    print('vectorized: {:.2f} s'.format(tFast))
+    print('speedup: {:.1f}x'.format(tLegacy / tFast))
+
+
+def benchmark_pipeline(nscenes, ntracks):
+    '''
+    Profile each inventory stage, returns dataframe of seconds & peak MB
+    '''
+    snwe = [-75, 75, -180, 180]
+    server, asf.ASF_URL = serve(synthetic_scenes(nscenes, ntracks))
+    stages = [('query', query_uncached, (snwe, {}, 365)),
+              ('load_asf_json', asf.load_asf_json, ('query_S1A.json',)),
+              ('merge_inventories', asf.merge_inventories,
+               ('query_S1A.json', 'query_S1B.json')),
+              ('update_store', store_update, ('query_S1A.json', 'query_S1B.json')),
+              ('load_store_inventory', store_inventory, ('benchmark_store.json',))]
+    results = []
+    try:
+        for name, func, args in stages:
+            seconds, peak, gf = profile(func, *args)
+            results.append((name, seconds, peak))
+        seconds, peak, coverage = profile(asf.roi_coverage, gf, snwe)
+        results.append(('roi_coverage', seconds, peak))
+        seconds, peak, dates = profile(summarize_dates, gf, coverage)
+        results.append(('summarize_dates', seconds, peak))
+        seconds, peak, dfS = profile(summarize_tracks, dates)
+        results.append(('summarize_tracks', seconds, peak))
+        # NOTE: second call skips unchanged file, so memory is for the comparison
+        seconds, peak, _ = profile(asf.save_inventory, gf)
+        results.append(('save_inventory', seconds, peak))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    df = pd.DataFrame(results, columns=['stage', 'seconds', 'peakMB'])
+    df['scenes'] = nscenes
+    return df
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    if args.compare:
+        for nscenes in args.nscenes:
+            compare_parsers(nscenes, args.tracks)
+    else:
+        cwd = os.getcwd()
+        results = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # inventory functions write to the current directory
+            os.chdir(tmpdir)
+            for nscenes in args.nscenes:
+                print('Benchmarking {} synthetic scenes...'.format(nscenes))
+                results.append(benchmark_pipeline(nscenes, args.tracks))
+            os.chdir(cwd)
+        df = pd.concat(results).pivot(index='stage', columns='scenes')
+        print(df.round(2))
+        df.to_csv('benchmark_inventory.csv')
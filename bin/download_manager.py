@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+'''
+Parallel, resumable SLC downloads verified against ASF metadata
+
+Several files are downloaded at once, each split into byte ranges fetched
+over separate connections into a preallocated .part file. Finished ranges
+are recorded in a .part.json sidecar, so an interrupted download resumes
+where it stopped. Files are checked against the ASF size ('bytes') and
+md5sum before being renamed into place. Servers without range support get
+a single streamed request. Earthdata credentials are read from ~/.netrc
+
+Input is a CSV manifest (url,bytes,md5sum) from prep_topsApp_aws.py or a
+plain list of urls (wget --input-file)
+
+Examples:
+download_manager.py -i download-manifest.csv -j 4 -c 4
+download_manager.py -i download-links.txt -o slcs
+'''
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from http_cache import get_session, write_atomic
+
+SEGMENT_BYTES = 64 * 2**20
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='download_manager.py')
+    parser.add_argument('-i', type=str, dest='input', required=True,
+            help='Manifest CSV (url,bytes,md5sum) or text file with one url per line')
+    parser.add_argument('-o', type=str, dest='outdir', required=False,
+            default='.',
+            help='Download directory')
+    parser.add_argument('-j', type=int, dest='workers', required=False,
+            default=4,
+            help='Number of files downloaded at once')
+    parser.add_argument('-c', type=int, dest='connections', required=False,
+            default=4,
+            help='Number of range connections per file')
+
+    return parser.parse_args()
+
+
+def make_job(url, size=None, md5=None):
+    '''
+    (url, bytes, md5sum) tuple, missing size or checksum become None
+    '''
+    try:
+        size = int(float(size))
+    except (TypeError, ValueError):
+        size = None  # None, '' or NaN
+    if not isinstance(md5, str) or not md5:
+        md5 = None
+    return (url, size, md5)
+
+
+def read_manifest(path):
+    '''
+    List of download jobs from manifest CSV or url list
+    '''
+    with open(path) as f:
+        if path.endswith('.csv'):
+            return [make_job(row['url'], row.get('bytes'), row.get('md5sum'))
+                    for row in csv.DictReader(f)]
+        return [make_job(line.strip()) for line in f if line.strip()]
+
+
+def write_manifest(jobs, path='download-manifest.csv'):
+    '''
+    Save download jobs as manifest CSV
+    '''
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['url', 'bytes', 'md5sum'])
+        for url, size, md5 in jobs:
+            writer.writerow([url, size or '', md5 or ''])
+
+
+def inventory_jobs(gf):
+    '''
+    Download jobs for inventory rows, with ASF sizes & checksums if present
+    '''
+    return [make_job(row.downloadUrl, getattr(row, 'bytes', None),
+                     getattr(row, 'md5sum', None))
+            for row in gf.itertuples()]
+
+
+def md5sum(path, blocksize=2**20):
+    ''' md5 hex digest of a file, read in blocks '''
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def verify(path, size=None, md5=None):
+    '''
+    Raise IOError if file doesn't match expected size or md5 checksum
+    '''
+    actual = os.path.getsize(path)
+    if size is not None and actual != size:
+        raise IOError('{}: {} bytes, expected {}'.format(path, actual, size))
+    if md5 and md5sum(path) != md5.lower():
+        raise IOError('{}: md5 checksum mismatch'.format(path))
+
+
+def probe(url, session):
+    '''
+    (size, supports ranges) from a one byte range request, which also
+    goes through any login redirects before the parallel requests start
+    '''
+    with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=300) as r:
+        r.raise_for_status()
+        if r.status_code == 206:
+            return int(r.headers['Content-Range'].split('/')[-1]), True
+        size = r.headers.get('Content-Length')
+        return (int(size) if size else None), False
+
+
+def fetch_range(url, partfile, start, stop, session):
+    '''
+    Write bytes [start, stop) of url into partfile at the same offset
+    '''
+    headers = {'Range': 'bytes={}-{}'.format(start, stop - 1)}
+    with session.get(url, headers=headers, stream=True, timeout=300) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError('Range request ignored: {}'.format(url))
+        with open(partfile, 'r+b') as f:
+            f.seek(start)
+            for block in r.iter_content(chunk_size=2**20):
+                f.write(block)
+            if f.tell() != stop:
+                raise IOError('Incomplete range {}-{} of {}'.format(start, stop, url))
+
+
+def fetch_stream(url, partfile, session):
+    ''' Whole file in a single request '''
+    with session.get(url, stream=True, timeout=300) as r:
+        r.raise_for_status()
+        with open(partfile, 'wb') as f:
+            for block in r.iter_content(chunk_size=2**20):
+                f.write(block)
+
+
+def read_state(statefile, size, segment):
+    '''
+    Finished segment numbers of a previous attempt, empty if none or if
+    it was for a different size or segment length
+    '''
+    try:
+        with open(statefile) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return set()
+    if state['size'] != size or state['segment'] != segment:
+        return set()
+    return set(state['done'])
+
+
+def download(url, outdir='.', size=None, md5=None, connections=4, session=None,
+             segment=SEGMENT_BYTES):
+    '''
+    Download url to outdir unless it is already there, returns local path
+    '''
+    session = session or get_session()
+    outname = os.path.join(outdir, os.path.basename(url))
+    if os.path.isfile(outname):
+        # NOTE: checksum was verified when the file was written
+        try:
+            verify(outname, size)
+            return outname
+        except IOError as e:
+            print('Replacing', e)
+            os.remove(outname)
+
+    partfile = outname + '.part'
+    statefile = partfile + '.json'
+    serverSize, ranges = probe(url, session)
+    if size is not None and serverSize is not None and serverSize != size:
+        raise IOError('{}: server has {} bytes, expected {}'.format(url, serverSize, size))
+    if size is None:
+        size = serverSize
+
+    if ranges and size:
+        done = read_state(statefile, size, segment)
+        if not os.path.isfile(partfile):
+            done = set()
+        if not done:
+            with open(partfile, 'wb') as f:
+                f.truncate(size)
+        segments = [(start, min(start + segment, size)) for start in range(0, size, segment)]
+        lock = threading.Lock()
+
+        def fetch(i):
+            start, stop = segments[i]
+            fetch_range(url, partfile, start, stop, session)
+            with lock:
+                done.add(i)
+                state = dict(size=size, segment=segment, done=sorted(done))
+                write_atomic(statefile, json.dumps(state), 'w')
+
+        todo = [i for i in range(len(segments)) if i not in done]
+        if len(todo) < len(segments):
+            print('Resuming {} ({} of {} segments done)'.format(
+                  os.path.basename(url), len(segments) - len(todo), len(segments)))
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            list(pool.map(fetch, todo))
+    else:
+        fetch_stream(url, partfile, session)
+
+    try:
+        verify(partfile, size, md5)
+    except IOError:
+        # corrupt, start over next time
+        os.remove(partfile)
+        if os.path.isfile(statefile):
+            os.remove(statefile)
+        raise
+    os.replace(partfile, outname)
+    if os.path.isfile(statefile):
+        os.remove(statefile)
+    return outname
+
+
+def download_all(jobs, outdir='.', workers=4, connections=4, session=None):
+    '''
+    Download (url, bytes, md5sum) jobs, several files at once
+    returns local paths in the same order
+    '''
+    session = session or get_session(workers * connections)
+    os.makedirs(outdir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(download, url, outdir, size, md5, connections, session)
+                   for url, size, md5 in jobs]
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    jobs = read_manifest(args.input)
+    print('Downloading {} files to {}'.format(len(jobs), args.outdir))
+    for path in download_all(jobs, args.outdir, args.workers, args.connections):
+        print(path)
@@ -6,18 +6,64 @@ bounding box)
 Outputs 2 JSON metadata files for S1A and S1B from ASF Vertex
 Outputs 1 merged GeoJSON inventory file
 
+Scene metadata is kept in a local store (inventory_store.json) keyed by
+granuleName, so repeated runs only ask ASF for scenes from a few days (-o)
+before the latest stored sceneDate, which also picks up frames ASF ingests
+late. Use -a to ignore the store and re-query the entire archive.
+
+Queries are split into date windows (-w days) and run concurrently for both
+platforms over a pooled connection (-j simultaneous requests).
+
+Date range, relative orbit(s), flight direction and polarization filters are
+passed on to the ASF API, so only scenes that will be processed are stored:
+get_inventory_asf.py -r 44.0 44.5 -122.0 -121.5 -p 115 -s 20170101 -e 20171231
+
+With -n, granules added since the previous run are saved to
+new_acquisitions.csv along with the sequential pairs they enable
+(new_pairs.csv), so daily runs only need to process the delta.
+
+With -m, many ROIs (e.g. all monitored volcanoes) are inventoried at once:
+nearby ROIs are merged into a few queries (query_{i}_S1A.json, snwe_{i}.*
+and csv/kml extras for each), each granule is stored once, and
+roi_index.csv lists the granules intersecting each ROI:
+get_inventory_asf.py -m volcanoes.geojson -g 1.0
+
 Author: Scott Henderson
 Date: 10/2017
 '''
 
 import argparse
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import json
-import shapely.wkt
+import re
+import shapely.geometry
 from shapely.geometry import box, mapping
+from shapely.ops import unary_union
 import pandas as pd
 import geopandas as gpd
 import os
+import shutil
+import sys
+import warnings
+
+from http_cache import atomic_open, cached_get, evict, get_session, write_atomic
+from inventory import (add_date_columns, add_orbit_code, summarize_dates,
+                       summarize_tracks, sequential_pairs)
+
+# NOTE: point ASF_URL at asf_standin.py for offline testing and benchmarks
+ASF_URL = os.environ.get('ASF_URL',
+                         'https://api.daac.asf.alaska.edu/services/search/param')
+# re-running the same query within an hour uses cached responses
+ASF_TTL = 3600
+LAUNCH_DATES = {'1A':'2014-04-03', '1B':'2016-04-25'}
+# refreshes re-query this many days before the latest stored scene
+LOOKBACK_DAYS = 5
+# text allowed between scene dictionaries in ASF JSON '[[{...},{...}]]'
+# (and the closing brace of inventory_store.json, see save_store)
+JSON_SEPARATORS = re.compile(r'[\s,\[\]}]*')
+# first line of inventory_store.json, followed by the query
+STORE_HEADER = '{"query": '
 
 
 def cmdLineParse():
@@ -32,70 +78,210 @@ def cmdLineParse():
             help='Polygon vector file defining region of interest')
     parser.add_argument('-b', type=float, dest='buffer', required=False,
             help='Add buffer [in degrees]')
+    parser.add_argument('-m', type=str, dest='multi', required=False,
+            help='Vector file with many ROI polygons (optional name column)')
+    parser.add_argument('-g', type=float, dest='gap', required=False, default=0,
+            help='Merge ROIs closer than this into one query [degrees]')
     parser.add_argument('-f', action='store_true', default=False, dest='footprints', required=False,
             help='Create subfolders with geojson footprints')
     parser.add_argument('-k', action='store_true', default=False, dest='kmls', required=False,
             help='Download kmls from ASF API')
     parser.add_argument('-c', action='store_true', default=False, dest='csvs', required=False,
             help='Download csvs from ASF API')
-
+    parser.add_argument('-a', action='store_true', default=False, dest='all', required=False,
+            help='Re-query entire archive (ignore local inventory store)')
+    parser.add_argument('-w', type=int, dest='window', required=False, default=180,
+            help='Query window length [days]')
+    parser.add_argument('-j', type=int, dest='workers', required=False, default=4,
+            help='Maximum number of simultaneous ASF requests')
+    parser.add_argument('-s', type=str, dest='start', required=False,
+            help='Start date (e.g. 20170101)')
+    parser.add_argument('-e', type=str, dest='end', required=False,
+            help='End date, inclusive (e.g. 20171231)')
+    parser.add_argument('-p', type=int, nargs='+', dest='orbits', required=False,
+            help='Path/Track/RelativeOrbit Number(s)')
+    parser.add_argument('-d', type=str, dest='direction', required=False,
+            choices=('ASCENDING','DESCENDING'),
+            help='Flight direction')
+    parser.add_argument('-l', type=str, dest='polarization', required=False,
+            help='Polarization (e.g. VV+VH)')
+    parser.add_argument('-n', action='store_true', default=False, dest='changes', required=False,
+            help='Save only new acquisitions & pairs since last run (new_*.csv)')
+    parser.add_argument('-o', type=float, dest='lookback', required=False,
+            default=LOOKBACK_DAYS,
+            help='Days before latest stored scene to query again (late arrivals)')
 
 
     return parser.parse_args()
 
 
-def load_asf_json(jsonfile):
-    ''' Convert JSON metadata from asf query to dataframe '''
+def iter_asf_json(jsonfile, chunksize=10000, blocksize=2**20):
+    '''
+    Incrementally parse ASF JSON response [[scene, scene, ...]]
+    yields lists of at most chunksize scene dictionaries
+    '''
     with open(jsonfile) as f:
-        meta = json.load(f)[0] #list of scene dictionaries
+        for chunk in iter_json_scenes(f, chunksize, blocksize):
+            yield chunk
+
+
+def iter_json_scenes(f, chunksize=10000, blocksize=2**20):
+    '''
+    Scene dictionaries in ASF JSON layout from the current position of
+    open file f to its end, in lists of at most chunksize
+    '''
+    decoder = json.JSONDecoder()
+    chunk = []
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        pos = JSON_SEPARATORS.match(buf, pos).end()
+        try:
+            if pos == len(buf):
+                raise ValueError('need more data')
+            scene, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # scene dictionary split across blocks, read some more
+            if eof:
+                if pos < len(buf):
+                    raise
+                break
+            block = f.read(blocksize)
+            eof = not block
+            buf = buf[pos:] + block
+            pos = 0
+            continue
+        chunk.append(scene)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_asf_json(jsonfile, chunksize=10000):
+    '''
+    Convert JSON metadata from asf query to dataframe
+    Scenes are parsed and converted chunksize at a time, so the full list
+    of scene dictionaries is never held in memory
+    '''
+    return chunks2gf(iter_asf_json(jsonfile, chunksize))
 
+
+def chunks2gf(chunks):
+    '''
+    Geodataframe from lists of ASF scene dictionaries, each list is
+    converted separately so only one chunk of dictionaries is expanded
+    at a time. Empty geodataframe if there are no scenes
+    '''
+    frames = [parse_scenes(meta) for meta in chunks]
+    if not frames:
+        return gpd.GeoDataFrame(geometry=[], crs={'init': 'epsg:4326'})
+    gf = pd.concat(frames, ignore_index=True)
+    # category codes depend on all orbits, so assign after concatenating
+    add_orbit_code(gf)
+
+    return gf
+
+
+def iter_chunks(items, chunksize=10000):
+    ''' Lists of at most chunksize items '''
+    items = iter(items)
+    chunk = list(itertools.islice(items, chunksize))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(items, chunksize))
+
+
+def scenes2gf(meta):
+    ''' Convert list of ASF scene dictionaries to geodataframe '''
+    gf = parse_scenes(meta)
+    add_orbit_code(gf)
+
+    return gf
+
+
+def parse_scenes(meta):
+    ''' Geodataframe with footprints and date columns for ASF scene dictionaries '''
     df = pd.DataFrame(meta)
-    polygons = df.stringFootprint.apply(shapely.wkt.loads)
+    # bulk WKT conversion (much faster than shapely.wkt.loads row by row)
+    polygons = gpd.GeoSeries.from_wkt(df.stringFootprint)
     gf = gpd.GeoDataFrame(df,
                           crs={'init': 'epsg:4326'},
                           geometry=polygons)
-
-    gf['timeStamp'] = pd.to_datetime(gf.sceneDate, format='%Y-%m-%d %H:%M:%S')
-    gf['sceneDateString'] = gf.timeStamp.apply(lambda x: x.strftime('%Y-%m-%d'))
-    gf['dateStamp'] = pd.to_datetime(gf.sceneDateString)
-    gf['utc'] = gf.timeStamp.apply(lambda x: x.strftime('%H:%M:%S'))
-    gf['orbitCode'] = gf.relativeOrbit.astype('category').cat.codes
+    add_date_columns(gf)
 
     return gf
 
-def summarize_orbits(gf):
-    '''
-    break inventory into separate dataframes by relative orbit
-    in most cases, inventory includes 2 adjacent frames (same date)
-    '''
-    # NOTE: could probably avoid for loop w/ hirearchical index?
-    #df115 = gf.groupby('relativeOrbit').get_group('115')
-    #gb = gf.groupby(['relativeOrbit', 'sceneDateString'])
-    #df = gb.get_group( ('93', '2017-05-11') )  # entire dataframes
-    # just polygons:
-    #gb.geometry.get_group( ('93', '2017-05-11') ) #.values
-    # just files nFrames
-    #gb.granuleName.get_group( ('93', '2017-05-11') ) #.tolist()
-    # Alternatively
-    #gf.loc[gb.groups[ ('93', '2017-05-11') ], ('granuleName','geometry')]
-    for orb in gf.relativeOrbit.unique():
-        df = gf.query('relativeOrbit == @orb')
-        gb = df.groupby('sceneDateString')
-        nFrames = gb.granuleName.count()
-        #frameLists = gb.granuleName.apply(lambda x: list(x))
-        df = df.loc[:,['sceneDateString','dateStamp','platform']] #consider list of granuleName
-        #Only keep one frame per date, not necessarily all intersecting...
-        DF  = df.drop_duplicates('sceneDateString').reset_index(drop=True)
-        DF.sort_values('sceneDateString', inplace=True)
-        DF.reset_index(inplace=True, drop=True)
-        timeDeltas = DF.dateStamp.diff()
-        DF['dt'] = timeDeltas.dt.days
-        #DF.dt.iloc[0] #Causes set w/ copy warning...
-        DF.loc[0, 'dt']=0
-        DF['dt'] = DF.dt.astype('i2')
-        DF['nFrames'] = nFrames.values
-        DF.drop('dateStamp', axis=1, inplace=True)
-        #DF.set_index('date') # convert to datetime difference
+def roi_coverage(gf, snwe):
+    '''
+    Fraction of region of interest covered by the union of all frames
+    for each (relativeOrbit, sceneDateString), 0 if no frames intersect
+    NOTE: report column only (coverage.csv and acquisitions*.csv), dates
+    and pairs are not filtered on it
+    '''
+    S,N,W,E = snwe
+    roi = box(W, S, E, N)
+    allDates = gf.loc[:, ['relativeOrbit','sceneDateString']].drop_duplicates()
+    index = pd.MultiIndex.from_frame(allDates)
+    # STRtree spatial index over footprints, only clip frames touching ROI
+    hits = gf.sindex.query(roi, predicate='intersects')
+    if len(hits) == 0:
+        print('WARNING: no frames intersect the region of interest')
+        coverage = pd.Series(0.0, index=index).sort_index()
+        return coverage.rename('coverage').to_frame()
+
+    clipped = gf.iloc[hits].loc[:, ['relativeOrbit','sceneDateString','geometry']]
+    clipped['geometry'] = clipped.geometry.intersection(roi)
+    dates = clipped.dissolve(by=['relativeOrbit','sceneDateString'])
+    with warnings.catch_warnings():
+        # area in square degrees is fine for a ratio within the ROI
+        warnings.simplefilter('ignore', UserWarning)
+        coverage = dates.area / roi.area
+
+    coverage = coverage.reindex(index, fill_value=0).sort_index()
+
+    return coverage.rename('coverage').to_frame()
+
+
+def change_feed(gf, dates, newGranules):
+    '''
+    Acquisitions added since the previous inventory (new_acquisitions.csv)
+    and the sequential pairs they enable on each track (new_pairs.csv)
+    '''
+    new = gf.loc[gf.granuleName.isin(newGranules),
+                 ['relativeOrbit','sceneDateString','platform','granuleName']]
+    new = new.sort_values(['relativeOrbit','sceneDateString']).reset_index(drop=True)
+    new.to_csv('new_acquisitions.csv', index=False)
+
+    # any pair with a date that gained frames (new date or late-arriving frame)
+    pairs = sequential_pairs(dates)
+    newDates = pd.MultiIndex.from_arrays([new.relativeOrbit,
+                                          new.sceneDateString.str.replace('-', '')])
+    isNew = (pd.MultiIndex.from_arrays([pairs.relativeOrbit, pairs.master]).isin(newDates) |
+             pd.MultiIndex.from_arrays([pairs.relativeOrbit, pairs.slave]).isin(newDates))
+    pairs = pairs.loc[isNew].reset_index(drop=True)
+    pairs.to_csv('new_pairs.csv', index=False)
+
+    summary = pd.DataFrame(dict(Granules=new.groupby('relativeOrbit').size(),
+                                Pairs=pairs.groupby('relativeOrbit').size()))
+    print('New since last inventory:')
+    print(summary.fillna(0).astype('int') if not summary.empty else 'nothing')
+
+    return new, pairs
+
+
+def summarize_orbits(dates):
+    '''
+    Save summarize_dates() table for all tracks (acquisitions.csv)
+    and separately for each relative orbit (acquisitions_{orbit}.csv)
+    '''
+    dates.drop('dateStamp', axis=1).to_csv('acquisitions.csv')
+    columns = [c for c in ('sceneDateString','platform','dt','nFrames','coverage')
+               if c in dates.reset_index().columns]
+    for orb, DF in dates.groupby(level='relativeOrbit'):
+        DF = DF.reset_index().loc[:, columns]
         DF.to_csv('acquisitions_{}.csv'.format(orb))
 
 def save_shapefiles(gf, master, slave):
@@ -106,38 +292,54 @@ def save_shapefiles(gf, master, slave):
     print('TODO')
 
 
-def save_geojson_footprints(gf):
+def write_if_changed(outname, text):
+    '''
+    Write text to file unless file already has identical contents
+    returns True if the file was (re)written
+    '''
+    if os.path.isfile(outname):
+        with open(outname) as f:
+            if f.read() == text:
+                return False
+    write_atomic(outname, text, 'w')
+    return True
+
+
+def save_geojson_footprints(gf, workers=4):
     '''
     Saves all frames from each date as separate geojson file for comparison on github
+    Features are serialized once (no fiona driver setup per file), grouped,
+    and only files whose contents changed are rewritten
     '''
-    attributes = ('granuleName','downloadUrl','geometry') #NOTE: could add IPF version...
+    attributes = ['granuleName','downloadUrl','geometry'] #NOTE: could add IPF version...
+    features = [json.dumps(feature) for feature in
+                gf.loc[:, attributes].iterfeatures(drop_id=True)]
     gb = gf.groupby(['relativeOrbit', 'sceneDateString'])
-    S = gf.groupby('relativeOrbit').sceneDateString.unique() #series w/ list of unique dates
-    for orbit, dateList in S.iteritems():
-        os.makedirs(orbit)
-        for date in dateList:
+    jobs = []
+    for (orbit, date), rows in gb.indices.items():
+        os.makedirs(str(orbit), exist_ok=True)
+        outname = os.path.join(str(orbit), date+'.geojson')
+        text = '{"type": "FeatureCollection", "features": [%s]}' % ', '.join(
+                features[i] for i in rows)
+        jobs.append((outname, text))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        written = sum(pool.map(lambda job: write_if_changed(*job), jobs))
+    print('Saved footprints: {} of {} files changed'.format(written, len(jobs)))
 
-            dftmp = gf.loc[gb.groups[ (orbit, date) ], attributes].reset_index(drop=True)
-            outname = os.path.join(orbit, date+'.geojson')
-            dftmp.to_file(outname, driver='GeoJSON')
 
-def summarize_inventory(gf):
+def summarize_inventory(dates):
     '''
     Basic statistics for each track
     '''
-    dfS = pd.DataFrame(index=gf.relativeOrbit.unique())
-    dfS['Start'] = gf.groupby('relativeOrbit').sceneDateString.min()
-    dfS['Stop'] =  gf.groupby('relativeOrbit').sceneDateString.max()
-    dfS['Dates'] = gf.groupby('relativeOrbit').sceneDateString.nunique()
-    dfS['Frames'] = gf.groupby('relativeOrbit').sceneDateString.count()
-    dfS['Direction'] = gf.groupby('relativeOrbit').flightDirection.first()
-    dfS['UTC'] = gf.groupby('relativeOrbit').utc.first()
-    dfS.sort_index(inplace=True, ascending=False)
-    dfS.index.name = 'Orbit'
+    dfS = summarize_tracks(dates)
     dfS.to_csv('inventory_summary.csv')
     print(dfS)
-    size = dfS.Frames.sum()*5 / 1e3
-    print('Approximate Archive size = {} Tb'.format(size))
+    size = dates.nBytes.sum(min_count=1) / 1e12
+    if pd.isnull(size):
+        print('Archive size = unknown (no bytes or sizeMB in ASF metadata)')
+    else:
+        print('Archive size = {:.2f} TB (see plan_capacity.py)'.format(size))
 
 
 def merge_inventories(s1Afile, s1Bfile):
@@ -146,7 +348,97 @@ def merge_inventories(s1Afile, s1Bfile):
     '''
     gfA = load_asf_json(s1Afile)
     gfB = load_asf_json(s1Bfile)
-    gf = pd.concat([gfA,gfB])
+    # NOTE: one platform can be empty (e.g. end date before S1B launch)
+    gf = pd.concat([gfA,gfB]) if not gfB.empty else gfA
+    gf.reset_index(inplace=True)
+    return gf
+
+
+def load_store(query, storefile='inventory_store.json'):
+    '''
+    Load persistent inventory store {granuleName: scene metadata}
+    Returns an empty store if none exists or it was made for a different
+    query (ROI, dates and filters). Scenes are read with the chunked ASF
+    JSON parser, so the file text is never held in memory
+    '''
+    store = dict(query=query, scenes={})
+    if not os.path.isfile(storefile):
+        return store
+    with open(storefile) as f:
+        header = f.readline()
+        if not header.endswith(',\n'):
+            # NOTE: stores saved before scenes were streamed are one document
+            previous = json.loads(header + f.read())
+            if previous.get('query') == query:
+                return previous
+        elif json.loads(header[len(STORE_HEADER):-2]) == query:
+            f.readline()  # "scenes": [[
+            for meta in iter_json_scenes(f):
+                store['scenes'].update({scene['granuleName']:scene for scene in meta})
+            return store
+    print('Query changed, ignoring existing store: ', storefile)
+    return store
+
+
+def save_store(store, storefile='inventory_store.json'):
+    '''
+    Write inventory store (via temporary file so an interrupted run can't
+    leave a truncated store behind). The query is on the first line and
+    scenes are a list in ASF JSON layout, one per line, for load_store()
+    '''
+    with atomic_open(storefile, 'w') as f:
+        f.write('{}{},\n"scenes": [[\n'.format(STORE_HEADER, json.dumps(store['query'])))
+        for i, scene in enumerate(store['scenes'].values()):
+            if i:
+                f.write(',\n')
+            json.dump(scene, f)
+        f.write('\n]]}\n')
+    print('Saved inventory store: ', storefile)
+
+
+def latest_scene_date(store, sat='1A'):
+    '''
+    Most recent sceneDate for a platform in the store (None if empty)
+    '''
+    platform = 'Sentinel-{}'.format(sat)
+    dates = [scene['sceneDate'] for scene in store['scenes'].values()
+             if scene['platform'] == platform]
+    if dates:
+        return max(dates)
+
+
+def refresh_start(store, sat='1A', lookback=LOOKBACK_DAYS):
+    '''
+    Query start for a platform: lookback days before its latest stored
+    sceneDate, so scenes ASF publishes late are still found (update_store
+    skips the overlap). None if the store has no scenes for the platform
+    '''
+    latest = latest_scene_date(store, sat)
+    if latest:
+        return pd.to_datetime(latest) - pd.Timedelta(days=lookback)
+
+
+def update_store(store, jsonfile):
+    '''
+    Upsert scenes from an ASF JSON query into the store, return new granules
+    '''
+    newGranules = []
+    nScenes = 0
+    for meta in iter_asf_json(jsonfile):
+        newGranules += [scene['granuleName'] for scene in meta
+                        if scene['granuleName'] not in store['scenes']]
+        store['scenes'].update({scene['granuleName']:scene for scene in meta})
+        nScenes += len(meta)
+    print('{}: {} scenes, {} new'.format(jsonfile, nScenes, len(newGranules)))
+    return newGranules
+
+
+def load_store_inventory(store, chunksize=10000):
+    '''
+    Inventory dataframe of all scenes in the store (S1A and S1B)
+    built chunksize scenes at a time
+    '''
+    gf = chunks2gf(iter_chunks(store['scenes'].values(), chunksize))
     gf.reset_index(inplace=True)
     return gf
 
@@ -154,15 +446,31 @@ def merge_inventories(s1Afile, s1Bfile):
 def save_inventory(gf, outname='query.geojson', format='GeoJSON'):
     '''
     Save entire inventory as a GeoJSON file (render on github)
+    GeoJSON is serialized directly and only rewritten if contents changed
+    Also saves typed columnar copy (query.parquet) that keeps datetime columns
     '''
-    # WARNING: overwrites existing file
-    if os.path.isfile(outname):
-        os.remove(outname)
     # NOTE: can't save pandas Timestamps!
     #ValueError: Invalid field type <class 'pandas._libs.tslib.Timestamp'>
-    gf.drop(['timeStamp', 'dateStamp'], axis=1, inplace=True)
-    gf.to_file(outname, driver=format)
-    print('Saved inventory: ', outname)
+    vf = gf.drop(['timeStamp', 'dateStamp'], axis=1)
+    if format == 'GeoJSON':
+        if write_if_changed(outname, vf.to_json(drop_id=True)):
+            print('Saved inventory: ', outname)
+        else:
+            print('Inventory unchanged: ', outname)
+    else:
+        # WARNING: overwrites existing file
+        if os.path.isfile(outname):
+            os.remove(outname)
+        vf.to_file(outname, driver=format)
+        print('Saved inventory: ', outname)
+
+    # NOTE: written after vector file, loaders only use it if it is newer
+    parquetName = os.path.splitext(outname)[0] + '.parquet'
+    try:
+        gf.to_parquet(parquetName)
+        print('Saved inventory: ', parquetName)
+    except ImportError as e:
+        print('Skipping GeoParquet inventory: ', e)
 
 def download_scene(downloadUrl):
     '''
@@ -174,31 +482,147 @@ def download_scene(downloadUrl):
     os.system(cmd)
     #use requests.get(auth=())
 
-def query_asf(snwe, sat='1A', format='json'):
+def asf_filters(args):
     '''
-    takes list of [south, north, west, east]
+    Additional ASF API search parameters from command line options
+    '''
+    filters = {}
+    if args.orbits:
+        filters['relativeOrbit'] = ','.join(str(x) for x in args.orbits)
+    if args.direction:
+        filters['flightDirection'] = args.direction
+    if args.polarization:
+        filters['polarization'] = args.polarization
+    return filters
+
+
+def asf_params(snwe, sat='1A', format='json', start=None, end=None, filters={}):
+    '''
+    ASF API search parameters for SNWE box, start/end are pandas Timestamps
+    filters are extra ASF parameters (relativeOrbit, flightDirection, etc.)
     '''
-    print('Querying ASF Vertex...')
     miny, maxy, minx, maxx = snwe
     roi = shapely.geometry.box(minx, miny, maxx, maxy)
-    polygonWKT = roi.to_wkt()
+    polygonWKT = roi.wkt
 
-    baseurl = 'https://api.daac.asf.alaska.edu/services/search/param'
-    #relativeOrbit=$ORBIT
     data=dict(intersectsWith=polygonWKT,
             platform='Sentinel-{}'.format(sat),
             processingLevel='SLC',
             beamMode='IW',
             output=format)
+    data.update(filters)
+    if start is not None:
+        data['start'] = start.strftime('%Y-%m-%dT%H:%M:%SUTC')
+    if end is not None:
+        data['end'] = end.strftime('%Y-%m-%dT%H:%M:%SUTC')
 
-    r = requests.get(baseurl, params=data)
-    with open('query_S{}.{}'.format(sat,format), 'w') as j:
-        j.write(r.text)
+    return data
+
+
+def query_asf(snwe, sat='1A', format='json', start=None, session=None,
+              end=None, filters={}, outname='query_S{}.{}'):
+    '''
+    takes list of [south, north, west, east]
+    optional start sceneDate ('%Y-%m-%d %H:%M:%S') to only get newer scenes
+    optional end date and extra ASF search filters
+    outname pattern is formatted with sat and format
+    '''
+    print('Querying ASF Vertex...')
+    if start:
+        start = pd.to_datetime(start)
+    if end:
+        end = end_of_day(end)
+    data = asf_params(snwe, sat, format, start, end, filters)
+
+    r = cached_get(ASF_URL, params=data, ttl=ASF_TTL, session=session, stream=True)
+    shutil.copyfile(r.path, outname.format(sat,format))
 
     #Directly to dataframe
     #df = pd.DataFrame(r.json()[0])
 
 
+def end_of_day(date):
+    ''' Last second of a date string, so end dates are inclusive '''
+    return pd.to_datetime(date).normalize() + pd.Timedelta(days=1, seconds=-1)
+
+
+def date_windows(start, end, days=180):
+    '''
+    Split [start, end] into list of (start, end) windows of given length
+    '''
+    edges = list(pd.date_range(start, end, freq='{}D'.format(days)))
+    if not edges or edges[-1] < end:
+        edges.append(end)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def query_window(session, snwe, sat, start, end, filters={}):
+    '''
+    Cached ASF JSON response (file path) for a single platform and date window
+    '''
+    data = asf_params(snwe, sat, 'json', start, end, filters)
+    return cached_get(ASF_URL, params=data, ttl=ASF_TTL, session=session,
+                      stream=True).path
+
+
+def query_asf_windows(snwe, starts={}, window=180, workers=4, session=None, pool=None,
+                      start=None, end=None, filters={}, outname='query_S{}.json'):
+    '''
+    Query S1A and S1B in parallel date windows, writes deduplicated
+    scenes for each platform to query_S1A.json and query_S1B.json
+    (outname pattern is formatted with '1A' or '1B'). Responses are
+    streamed from the cache one chunk at a time, in window order
+
+    starts is an optional {sat: sceneDate} to only get newer scenes
+    start, end and filters restrict the search on the ASF side
+    '''
+    if session is None:
+        session = get_session(workers)
+    stop = pd.Timestamp.now('UTC').tz_localize(None).ceil('D')
+    if end:
+        stop = min(stop, end_of_day(end))
+    jobs = []
+    for sat in ('1A', '1B'):
+        first = pd.to_datetime(starts.get(sat) or LAUNCH_DATES[sat])
+        if start:
+            first = max(first, pd.to_datetime(start))
+        for t0, t1 in date_windows(first, stop, window):
+            jobs.append((sat, t0, t1))
+    print('Querying ASF Vertex ({} requests)...'.format(len(jobs)))
+
+    ownPool = pool is None
+    if ownPool:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    futures = [pool.submit(query_window, session, snwe, sat, t0, t1, filters)
+               for sat, t0, t1 in jobs]
+    try:
+        for sat in ('1A', '1B'):
+            seen = set()
+            with open(outname.format(sat), 'w') as j:
+                j.write('[[')
+                for (s, t0, t1), future in zip(jobs, futures):
+                    if s != sat:
+                        continue
+                    for meta in iter_asf_json(future.result()):
+                        for scene in sorted(meta, key=lambda x: x['sceneDate']):
+                            # windows share boundary timestamps, so dedup on granuleName
+                            if scene['granuleName'] in seen:
+                                continue
+                            if seen:
+                                j.write(',')
+                            seen.add(scene['granuleName'])
+                            json.dump(scene, j)
+                j.write(']]')
+    except BaseException:
+        # don't leave the remaining windows running after a failure
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        if ownPool:
+            pool.shutdown(cancel_futures=True)
+
+
 def ogr2snwe(args):
     gf = gpd.read_file(args.input)
     gf.to_crs(epsg=4326, inplace=True)
@@ -209,17 +633,66 @@ def ogr2snwe(args):
     args.roi = [S,N,W,E]
 
 
-def snwe2file(args):
+def ogr2clusters(vectorFile, buffer=None, gap=0):
+    '''
+    Read many ROI polygons (e.g. volcanoes) and merge ROIs whose bounding
+    boxes overlap, or are within gap degrees, into a minimal set of query boxes
+    Returns (rois geodataframe with 'name' column, list of SNWE boxes)
+    '''
+    rois = gpd.read_file(vectorFile)
+    rois.to_crs(epsg=4326, inplace=True)
+    if 'name' not in rois:
+        rois['name'] = rois.index.astype(str)
+    if buffer:
+        rois['geometry'] = rois.buffer(buffer)
+
+    # repeat until merged boxes no longer overlap each other
+    boxes = [box(*bounds).buffer(gap/2.0, join_style=2)
+             for bounds in rois.bounds.values]
+    while True:
+        merged = unary_union(boxes)
+        parts = getattr(merged, 'geoms', [merged])
+        merged = [box(*part.bounds) for part in parts]
+        if len(merged) == len(boxes):
+            break
+        boxes = merged
+
+    clusters = []
+    for cluster in merged:
+        W,S,E,N = cluster.bounds
+        clusters.append([S,N,W,E])
+    print('{} ROIs merged into {} queries'.format(len(rois), len(clusters)))
+
+    return rois, clusters
+
+
+def index_rois(gf, rois):
     '''
-    Use shapely to convert to GeoJSON & WKT
+    (roi, granuleName) for every granule intersecting each ROI
+    per-ROI inventories are views of the shared inventory (see roi_inventory)
     '''
-    S,N,W,E = args.roi
+    joined = gpd.sjoin(gf.loc[:, ['granuleName','geometry']],
+                       rois.loc[:, ['name','geometry']],
+                       predicate='intersects')
+    roiIndex = joined.loc[:, ['name','granuleName']].rename(columns={'name':'roi'})
+    roiIndex.sort_values(['roi','granuleName'], inplace=True)
+    roiIndex.reset_index(drop=True, inplace=True)
+    print(roiIndex.groupby('roi').size().rename('Frames').to_string())
+
+    return roiIndex
+
+
+def snwe2file(snwe, prefix='snwe'):
+    '''
+    Use shapely to convert to GeoJSON & WKT ({prefix}.json, .wkt and .txt)
+    '''
+    S,N,W,E = snwe
     roi = box(W, S, E, N)
-    with open('snwe.json', 'w') as j:
+    with open(prefix + '.json', 'w') as j:
         json.dump(mapping(roi), j)
-    with open('snwe.wkt', 'w') as w:
-        w.write(roi.to_wkt())
-    with open('snwe.txt', 'w') as t:
+    with open(prefix + '.wkt', 'w') as w:
+        w.write(roi.wkt)
+    with open(prefix + '.txt', 'w') as t:
         snweList = '[{0:.3f}, {1:.3f}, {2:.3f}, {3:.3f}]'.format(S,N,W,E)
         t.write(snweList)
     print(snweList)
@@ -227,19 +700,61 @@ def snwe2file(args):
 
 if __name__ == '__main__':
     args = cmdLineParse()
-    if args.input:
-        ogr2snwe(args)
-    snwe2file(args)
-    query_asf(args.roi, '1A')
-    query_asf(args.roi, '1B')
-    gf = merge_inventories('query_S1A.json', 'query_S1B.json')
-    summarize_inventory(gf)
-    summarize_orbits(gf)
+    if args.multi:
+        # NOTE: no overall bounds, every query, snwe file & extra is per cluster
+        rois, clusters = ogr2clusters(args.multi, args.buffer, args.gap)
+        prefix = 'query_{}_'
+    else:
+        if args.input:
+            ogr2snwe(args)
+        clusters = [args.roi]
+        prefix = 'query_'
+    for i,snwe in enumerate(clusters):
+        snwe2file(snwe, 'snwe_{}'.format(i) if args.multi else 'snwe')
+    filters = asf_filters(args)
+    store = load_store(dict(roi=clusters, start=args.start, end=args.end, **filters))
+    # -n compares with the previous run, even if -a re-queries everything
+    previous = set(store['scenes'])
+    if args.all:
+        store['scenes'] = {}
+    starts = {sat:refresh_start(store, sat, args.lookback) for sat in ('1A', '1B')}
+    session = get_session(args.workers)
+    formats = [fmt for fmt,flag in (('csv',args.csvs), ('kml',args.kmls)) if flag]
+    queryFiles = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        extras = [pool.submit(query_asf, snwe, '1A', fmt, args.start, session,
+                              args.end, filters, prefix.format(i) + 'S{}.{}')
+                  for i,snwe in enumerate(clusters) for fmt in formats]
+        for i,snwe in enumerate(clusters):
+            outname = prefix.format(i) + 'S{}.json'
+            query_asf_windows(snwe, starts, args.window, session=session, pool=pool,
+                              start=args.start, end=args.end, filters=filters,
+                              outname=outname)
+            queryFiles += [outname.format(sat) for sat in ('1A', '1B')]
+        for future in extras:
+            future.result()
+    for queryFile in queryFiles:
+        update_store(store, queryFile)
+    newGranules = [name for name in store['scenes'] if name not in previous]
+    save_store(store)
+    # NOTE: streamed ASF responses are only pruned once every query file is read
+    evict()
+    gf = load_store_inventory(store)
+    if gf.empty:
+        print('No scenes match the query, nothing to summarize')
+        sys.exit()
+    if args.multi:
+        # coverage of overall bounds is meaningless for scattered ROIs
+        coverage = None
+        index_rois(gf, rois).to_csv('roi_index.csv', index=False)
+    else:
+        coverage = roi_coverage(gf, args.roi)
+        coverage.to_csv('coverage.csv')
+    dates = summarize_dates(gf, coverage)
+    summarize_inventory(dates)
+    summarize_orbits(dates)
+    if args.changes:
+        change_feed(gf, dates, newGranules)
     save_inventory(gf)
-    if args.csvs:
-        query_asf(args.roi, '1A','csv')
-    if args.kmls:
-        query_asf(args.roi, '1A','kml')
     if args.footprints:
-	    save_geojson_footprints(gf) #NOTE: takes a while...
-
+        save_geojson_footprints(gf, args.workers)
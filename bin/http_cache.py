@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+'''
+Shared HTTP client for the inventory and prep scripts
+
+One pooled requests session (failed requests retried w/ exponential backoff)
+and an on-disk response cache in $DINOSAR_CACHE/http (default
+~/.cache/dinosar/http). Cached responses younger than ttl seconds are used
+without any request, older ones are revalidated with If-None-Match /
+If-Modified-Since so unchanged pages only cost a 304. When offline (or the
+server keeps failing), stale cached responses are used instead of failing.
+Least recently used responses are removed once the cache exceeds
+$DINOSAR_HTTP_CACHE_MB (default 200), so one-off queries don't pile up.
+
+Examples:
+from http_cache import cached_get
+r = cached_get('https://s1qc.asf.alaska.edu/aux_poeorb', ttl=6*3600)
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import html
+
+CACHE_DIR = os.environ.get('DINOSAR_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'dinosar'))
+HTTP_CACHE_MB = float(os.environ.get('DINOSAR_HTTP_CACHE_MB', 200))
+
+_session = None
+_poolsize = 0
+_lock = threading.Lock()
+
+
+class CachedResponse(object):
+    '''
+    Minimal requests.Response look-alike for fresh or cached content
+    the body stays on disk (path) until content is first used
+    '''
+    def __init__(self, url, path, headers, fromCache=False):
+        self.url = url
+        self.path = path
+        self.headers = headers
+        self.status_code = 200
+        self.from_cache = fromCache
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            with open(self.path, 'rb') as f:
+                self._content = f.read()
+        return self._content
+
+    @property
+    def text(self):
+        contentType = self.headers.get('Content-Type', '')
+        encoding = 'utf-8'
+        if 'charset=' in contentType:
+            encoding = contentType.split('charset=')[-1].split(';')[0].strip()
+        return self.content.decode(encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+
+def get_session(workers=10, retries=5):
+    '''
+    Shared pooled session, created on first use. connection pools grow
+    if a later caller asks for more workers
+    '''
+    global _session, _poolsize
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+        if workers > _poolsize:
+            retry = Retry(total=retries, backoff_factor=1,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=workers,
+                                  max_retries=retry)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _poolsize = workers
+    return _session
+
+
+def cache_paths(url, cachedir=None):
+    '''
+    (metadata, body) cache files for a full request url
+    '''
+    cachedir = os.path.join(cachedir or CACHE_DIR, 'http')
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return (os.path.join(cachedir, key + '.json'),
+            os.path.join(cachedir, key + '.body'))
+
+
+@contextmanager
+def atomic_open(path, mode='wb'):
+    '''
+    File object for writing path via a temporary file (unique per process
+    and thread), which replaces path once closed, so concurrent readers
+    never see partial files. removed instead if writing fails
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmpfile = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmpfile, mode) as f:
+            yield f
+        os.replace(tmpfile, path)
+    except BaseException:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+def write_atomic(path, data, mode='wb'):
+    '''
+    Write via temporary file so concurrent readers never see partial files
+    '''
+    with atomic_open(path, mode) as f:
+        f.write(data)
+
+
+def cached_get(url, params=None, ttl=3600, session=None, cachedir=None, timeout=300,
+               stream=False):
+    '''
+    GET url through the on-disk cache, returns CachedResponse
+    ttl=0 always revalidates, ttl=None never expires. With stream=True the
+    body is left on disk (response.path) for reading in pieces and the cache
+    isn't pruned, callers run evict() once they have read the files
+    '''
+    r = cached_response(url, params, ttl, session, cachedir, timeout)
+    if not stream:
+        r.content  # read now, so later evictions can't remove it first
+        if not r.from_cache:
+            evict(cachedir, fraction=0.9, keep=[r.path])
+    return r
+
+
+def cached_response(url, params=None, ttl=3600, session=None, cachedir=None, timeout=300):
+    '''
+    CachedResponse for url with the body on disk, fetched or revalidated
+    as needed (see cached_get)
+    '''
+    session = session or get_session()
+    fullUrl = requests.Request('GET', url, params=params).prepare().url
+    metafile, bodyfile = cache_paths(fullUrl, cachedir)
+
+    meta = None
+    if os.path.isfile(metafile) and os.path.isfile(bodyfile):
+        with open(metafile) as f:
+            meta = json.load(f)
+        age = time.time() - meta['fetched']
+        if ttl is None or age < ttl:
+            os.utime(bodyfile)  # mark as recently used
+            return CachedResponse(fullUrl, bodyfile, meta['headers'], True)
+
+    headers = {}
+    if meta and meta['headers'].get('ETag'):
+        headers['If-None-Match'] = meta['headers']['ETag']
+    if meta and meta['headers'].get('Last-Modified'):
+        headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+    try:
+        r = session.get(fullUrl, headers=headers, stream=True, timeout=timeout)
+    except (requests.ConnectionError, requests.exceptions.RetryError):
+        if meta is None:
+            raise
+        # offline or server down, stale copy is better than nothing
+        print('WARNING: using cached copy of {}'.format(fullUrl))
+        os.utime(bodyfile)
+        return CachedResponse(fullUrl, bodyfile, meta['headers'], True)
+    if r.status_code == 304 and meta:
+        r.close()
+        meta['fetched'] = time.time()
+        write_atomic(metafile, json.dumps(meta), 'w')
+        os.utime(bodyfile)
+        return CachedResponse(fullUrl, bodyfile, meta['headers'], True)
+    with r:
+        r.raise_for_status()
+        # NOTE: body streamed to disk, large responses are never held in memory
+        with atomic_open(bodyfile) as f:
+            for block in r.iter_content(chunk_size=2**20):
+                f.write(block)
+
+    keep = ('Content-Type', 'ETag', 'Last-Modified')
+    meta = dict(url=fullUrl, fetched=time.time(),
+                headers={k:r.headers[k] for k in keep if k in r.headers})
+    write_atomic(metafile, json.dumps(meta), 'w')
+    return CachedResponse(fullUrl, bodyfile, meta['headers'])
+
+
+def cached_responses(cachedir=None):
+    ''' List of (last used, bytes, body file) for cached responses '''
+    httpdir = os.path.join(cachedir or CACHE_DIR, 'http')
+    responses = []
+    if os.path.isdir(httpdir):
+        for name in os.listdir(httpdir):
+            if not name.endswith('.body'):
+                continue  # metadata and writes in progress
+            bodyfile = os.path.join(httpdir, name)
+            try:
+                st = os.stat(bodyfile)
+            except FileNotFoundError:
+                continue  # evicted by another process
+            responses.append((st.st_mtime, st.st_size, bodyfile))
+    return responses
+
+
+def evict(cachedir=None, maxMB=None, fraction=1.0, keep=[]):
+    '''
+    Remove least recently used responses (except body files in keep) until
+    the http cache is below fraction * maxMB, returns remaining bytes
+    '''
+    if maxMB is None:
+        maxMB = HTTP_CACHE_MB
+    keep = set(keep)
+    def remove(bodyfile):
+        if bodyfile in keep:
+            return False
+        # metadata first, so readers never find metadata without a body
+        for path in (bodyfile[:-5] + '.json', bodyfile):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+    return evict_lru(cached_responses(cachedir), maxMB * 2**20, fraction, remove)
+
+
+def evict_lru(entries, maxBytes, fraction=1.0, remove=os.remove):
+    '''
+    Least recently used eviction shared by the on-disk caches: once the
+    (last used, bytes, path) entries exceed maxBytes, remove(path) oldest
+    first until below fraction * maxBytes. fraction < 1 leaves room so the
+    next few writes don't trigger another scan. remove returns False to
+    keep an entry (e.g. in use). returns remaining bytes
+    '''
+    entries = sorted(entries)
+    total = sum(size for used, size, path in entries)
+    if total <= maxBytes:
+        return total
+    target = fraction * maxBytes
+    for used, size, path in entries:
+        if total <= target:
+            break
+        try:
+            if remove(path) is False:
+                continue
+        except FileNotFoundError:
+            pass  # removed by another process
+        total -= size
+    return total
+
+
+def list_links(url, ttl=3600, depth=1, suffix=''):
+    '''
+    Absolute urls of links in an HTML directory listing ending with suffix,
+    following subdirectory links up to depth levels (like wget -r -l)
+    '''
+    if not url.endswith('/'):
+        url += '/'
+    r = cached_get(url, ttl=ttl)
+    webpage = html.fromstring(r.content)
+    links = []
+    for href in webpage.xpath('//a/@href'):
+        link = urljoin(url, href)
+        if not link.startswith(url) or link == url or '?' in href:
+            continue  # parent directory, sort links, other sites
+        if link.endswith('/') and depth > 1:
+            links += list_links(link, ttl, depth - 1, suffix)
+        elif link.endswith(suffix):
+            links.append(link)
+    return links
+
+
+def download_file(url, outdir='.', session=None, clobber=False):
+    '''
+    Stream url to outdir (no clobber by default, like wget -nc)
+    returns local path
+    '''
+    session = session or get_session()
+    outname = os.path.join(outdir, os.path.basename(url.rstrip('/')))
+    if os.path.isfile(outname) and not clobber:
+        return outname
+    with session.get(url, stream=True, timeout=300) as r:
+        r.raise_for_status()
+        with atomic_open(outname) as f:
+            for block in r.iter_content(chunk_size=2**20):
+                f.write(block)
+    return outname
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+'''
+Shared inventory functions for get_inventory_asf.py, prep_topsApp.py,
+prep_topsApp_aws.py and plot_inventory_asf.py
+
+load_inventory() prefers the GeoParquet copy of the inventory. For GeoJSON
+inventories the derived columns (timeStamp, sceneDateString, dateStamp, utc,
+orbitCode) are cached on disk keyed by file path, size and modification time,
+so repeated calls (e.g. prep_topsApp.py for every pair in a batch) only pay
+for them once. Cache directory is $DINOSAR_CACHE (default ~/.cache/dinosar)
+'''
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from http_cache import CACHE_DIR, atomic_open
+
+# in-process copies of loaded inventories {file_key: geodataframe}
+_loaded = {}
+
+
+def add_date_columns(gf):
+    '''
+    Add timeStamp, sceneDateString, dateStamp and utc columns (vectorized)
+    '''
+    gf['timeStamp'] = pd.to_datetime(gf.sceneDate, format='%Y-%m-%d %H:%M:%S')
+    dateStamp = gf.timeStamp.dt.normalize()
+    gf['sceneDateString'] = dateStamp.dt.strftime('%Y-%m-%d')
+    gf['dateStamp'] = dateStamp
+    gf['utc'] = gf.timeStamp.dt.strftime('%H:%M:%S')
+
+
+def add_orbit_code(gf):
+    '''
+    Add integer code for each relative orbit (for plotting)
+    '''
+    gf['orbitCode'] = gf.relativeOrbit.astype('category').cat.codes
+
+
+def granule_bytes(gf):
+    '''
+    Size of each granule in bytes from ASF metadata ('bytes' or 'sizeMB')
+    NaN if the inventory has neither
+    '''
+    if 'bytes' in gf:
+        return pd.to_numeric(gf['bytes'], errors='coerce')
+    if 'sizeMB' in gf:
+        return pd.to_numeric(gf.sizeMB, errors='coerce') * 2**20
+    return pd.Series(np.nan, index=gf.index)
+
+
+def file_key(path):
+    '''
+    Identify a file by absolute path, size and modification time
+    '''
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def cache_file(key, kind='inventory'):
+    '''
+    Location of cached data for file_key()
+    '''
+    name = hashlib.sha1(key[0].encode()).hexdigest()
+    return os.path.join(CACHE_DIR, kind, name + '.pkl')
+
+
+def read_cache(key, kind='inventory'):
+    '''
+    Cached object for file_key(), None if missing or stale
+    '''
+    cachefile = cache_file(key, kind)
+    if os.path.isfile(cachefile):
+        try:
+            with open(cachefile, 'rb') as f:
+                cachedKey, data = pickle.load(f)
+            if cachedKey == key:
+                return data
+        except Exception as e:
+            print('Ignoring unreadable cache: ', cachefile, e)
+
+
+def write_cache(key, data, kind='inventory'):
+    '''
+    Save object for file_key() (via temporary file for concurrent jobs)
+    '''
+    with atomic_open(cache_file(key, kind)) as f:
+        pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_inventory(vectorFile, columns=None):
+    '''
+    load merged (S1A and S1B) inventory with derived columns
+    prefers GeoParquet copy (query.parquet) if present, optionally reading
+    only the given columns (NaN if the inventory doesn't have them)
+    '''
+    if columns:
+        columns = list(columns) + ['geometry']
+    parquetFile = os.path.splitext(vectorFile)[0] + '.parquet'
+    if (os.path.isfile(parquetFile) and
+        os.path.getmtime(parquetFile) >= os.path.getmtime(vectorFile)):
+        try:
+            # typed copy from get_inventory_asf.py, derived columns included
+            if not columns:
+                return gpd.read_parquet(parquetFile)
+            import pyarrow.parquet
+            names = pyarrow.parquet.read_schema(parquetFile).names
+            gf = gpd.read_parquet(parquetFile,
+                                  columns=[col for col in columns if col in names])
+            return select_columns(gf, columns)
+        except ImportError as e:
+            print('Reading GeoJSON inventory instead: ', e)
+
+    key = file_key(vectorFile)
+    gf = _loaded.get(key)
+    if gf is None:
+        gf = read_cache(key)
+    if gf is None:
+        gf = gpd.read_file(vectorFile)
+        add_date_columns(gf)
+        add_orbit_code(gf)
+        write_cache(key, gf)
+    _loaded[key] = gf
+
+    # callers modify their inventory, so don't hand out the cached copy
+    if columns:
+        return select_columns(gf, columns)
+    return gf.copy()
+
+
+def select_columns(gf, columns):
+    '''
+    Copy of gf with only the given columns. Columns missing from older
+    inventories (e.g. bytes, md5sum, processingDate) are filled with NaN,
+    so size, checksum and processing date checks are skipped
+    '''
+    missing = [col for col in columns if col not in gf.columns]
+    if missing:
+        print('Inventory has no {} columns, using NaN'.format(', '.join(missing)))
+    return gf.reindex(columns=columns)
+
+
+def summarize_dates(gf, coverage=None):
+    '''
+    Statistics for every (relativeOrbit, sceneDateString) in a single grouped
+    pass over the inventory. in most cases, inventory includes 2 adjacent
+    frames (same date). nBytes is the total size of those frames (NaN if
+    ASF metadata has no sizes). optional coverage table from roi_coverage()
+    adds ROI fraction per date
+    '''
+    gb = gf.assign(nBytes=granule_bytes(gf)).groupby(['relativeOrbit', 'sceneDateString'])
+    dates = gb.agg(dateStamp=('dateStamp', 'first'),
+                   platform=('platform', 'first'),
+                   flightDirection=('flightDirection', 'first'),
+                   utc=('utc', 'first'),
+                   nFrames=('granuleName', 'count'))
+    # NOTE: min_count so unknown sizes stay NaN instead of summing to 0
+    dates['nBytes'] = gb.nBytes.sum(min_count=1)
+    timeDeltas = dates.groupby(level='relativeOrbit').dateStamp.diff()
+    dates['dt'] = timeDeltas.dt.days.fillna(0).astype('i2')
+    if coverage is not None:
+        dates['coverage'] = coverage.coverage.reindex(dates.index).values
+
+    return dates
+
+
+def summarize_tracks(dates):
+    '''
+    Basic statistics for each track from summarize_dates() table
+    '''
+    gb = dates.reset_index().groupby('relativeOrbit')
+    dfS = gb.agg(Start=('sceneDateString', 'min'),
+                 Stop=('sceneDateString', 'max'),
+                 Dates=('sceneDateString', 'nunique'),
+                 Frames=('nFrames', 'sum'),
+                 Direction=('flightDirection', 'first'),
+                 UTC=('utc', 'first'))
+    dfS.sort_index(inplace=True, ascending=False)
+    dfS.index.name = 'Orbit'
+
+    return dfS
+
+
+def sequential_pairs(dates):
+    '''
+    Sequential interferogram pairs for every track in summarize_dates() table
+    master is the later date, slave the preceding date ('%Y%m%d' strings)
+    '''
+    df = dates.reset_index().loc[:, ['relativeOrbit', 'dateStamp']]
+    df.sort_values(['relativeOrbit', 'dateStamp'], inplace=True)
+    df['slave'] = df.groupby('relativeOrbit').dateStamp.shift()
+    pairs = df.dropna(subset=['slave']).reset_index(drop=True)
+    pairs['master'] = pairs.dateStamp.dt.strftime('%Y%m%d')
+    pairs['slave'] = pairs.slave.dt.strftime('%Y%m%d')
+
+    return pairs.loc[:, ['relativeOrbit', 'master', 'slave']]
+
+
+def roi_inventory(gf, roiIndex, name):
+    '''
+    Inventory of a single ROI from shared multi-ROI inventory and its
+    roi_index.csv (get_inventory_asf.py -m)
+    '''
+    granules = roiIndex.loc[roiIndex.roi == name, 'granuleName']
+    return gf.loc[gf.granuleName.isin(granules)]
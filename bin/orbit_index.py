@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+'''
+Local index of Sentinel-1 precise orbit files (aux_poeorb)
+
+The aux_poeorb listing is parsed once into a compact table (orbit file,
+satellite, creation time, validity start & stop) saved as
+$DINOSAR_CACHE/orbits/aux_poeorb.csv. After ttl seconds the listing is
+revalidated (see http_cache.py): an unchanged listing only costs a 304,
+a changed one is downloaded in full, but only file names not yet in the
+table are parsed and appended. Lookups match acquisition times against
+validity windows instead of comparing file name dates with the day before
+
+resolve_orbits() matches a whole inventory (or the scenes of a pair list)
+in one sorted merge, giving the unique orbit files a batch needs (saved to
+orbits.csv, optionally downloaded together) and the acquisitions without
+a precise orbit, which can fall back to restituted orbits (aux_resorb)
+
+Examples:
+orbit_index.py -g S1A_IW_SLC__1SDV_20170927T014703_20170927T014730_018548_01F42A_66E6
+orbit_index.py -i query.geojson -l new_pairs.csv -r -o $POEORB
+'''
+import argparse
+import os
+import re
+import time
+import pandas as pd
+
+from download_manager import download_all, make_job
+from http_cache import CACHE_DIR, cached_get, write_atomic
+from inventory import load_inventory
+
+POEORB_URL = 'https://s1qc.asf.alaska.edu/aux_poeorb'
+RESORB_URL = 'https://s1qc.asf.alaska.edu/aux_resorb'
+INDEX_TTL = 6*3600
+# S1A_OPER_AUX_POEORB_OPOD_20170101T121500_V20161211T225943_20161213T005943.EOF
+ORBIT_NAME = re.compile(r'S1[AB]_OPER_AUX_\w{6}_OPOD_\d{8}T\d{6}_V\d{8}T\d{6}_\d{8}T\d{6}\.EOF')
+TIME_FORMAT = '%Y%m%dT%H%M%S'
+
+# in-process copies {indexfile: (time loaded, index)}
+_loaded = {}
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='orbit_index.py')
+    parser.add_argument('-g', type=str, nargs='+', dest='granules', required=False,
+            help='Granule name(s) to find precise orbits for')
+    parser.add_argument('-i', type=str, dest='inventory', required=False,
+            help='Find orbits for every scene in inventory (query.geojson)')
+    parser.add_argument('-l', type=str, dest='pairs', required=False,
+            help='Only scenes of pairs in CSV list (relativeOrbit,master,slave)')
+    parser.add_argument('-r', action='store_true', default=False, dest='resorb', required=False,
+            help='Restituted orbits for scenes without precise orbits')
+    parser.add_argument('-o', type=str, dest='outdir', required=False,
+            help='Download the orbit files to this directory')
+    parser.add_argument('-t', type=float, dest='ttl', required=False,
+            default=INDEX_TTL,
+            help='Seconds before listing is checked for new orbit files')
+
+    return parser.parse_args()
+
+
+def parse_orbit_names(names):
+    '''
+    Table of satellite, creation time and validity window from orbit file names
+    '''
+    names = pd.Series(sorted(set(names)), dtype=object)
+    return pd.DataFrame({'orbit': names,
+                         'satellite': names.str[:3],
+                         'created': pd.to_datetime(names.str[25:40], format=TIME_FORMAT),
+                         'start': pd.to_datetime(names.str[42:57], format=TIME_FORMAT),
+                         'stop': pd.to_datetime(names.str[58:73], format=TIME_FORMAT)})
+
+
+def index_file(url=POEORB_URL, cachedir=None):
+    ''' Location of saved index for an orbit listing '''
+    return os.path.join(cachedir or CACHE_DIR, 'orbits', os.path.basename(url) + '.csv')
+
+
+def read_index(indexfile):
+    ''' Saved orbit index '''
+    return pd.read_csv(indexfile, parse_dates=['created', 'start', 'stop'])
+
+
+def load_orbit_index(url=POEORB_URL, ttl=INDEX_TTL, cachedir=None):
+    '''
+    Orbit index sorted by satellite, validity start and creation time
+    the listing is only requested when the saved index is older than ttl,
+    and only downloaded again (whole page) when it has changed
+    '''
+    indexfile = index_file(url, cachedir)
+    loadTime, index = _loaded.get(indexfile, (0, None))
+    if time.time() - loadTime < ttl:
+        return index
+
+    if os.path.isfile(indexfile):
+        index = read_index(indexfile)
+        if time.time() - os.path.getmtime(indexfile) < ttl:
+            _loaded[indexfile] = (time.time(), index)
+            return index
+
+    r = cached_get(url, ttl=0)  # 304 if listing unchanged
+    if index is not None and r.from_cache:
+        os.utime(indexfile)
+    else:
+        names = set(ORBIT_NAME.findall(r.text))
+        if index is not None:
+            names = names.difference(index.orbit)
+        print('Adding {} orbit files to {}'.format(len(names), indexfile))
+        index = pd.concat([index, parse_orbit_names(names)], ignore_index=True)
+        index.sort_values(['satellite', 'start', 'created'], inplace=True)
+        index.reset_index(drop=True, inplace=True)
+        write_atomic(indexfile, index.to_csv(index=False), 'w')
+
+    _loaded[indexfile] = (time.time(), index)
+    return index
+
+
+def resolve_orbits(granules, index):
+    '''
+    Newest orbit file covering each acquisition in one sorted merge:
+    latest validity start before sensing start (per satellite), kept if it
+    also lasts past sensing stop. returns table of granuleName, orbit
+    (NaN without coverage) and orbit validity
+    '''
+    df = pd.DataFrame({'granuleName': pd.unique(pd.Series(granules, dtype=object))})
+    df['satellite'] = df.granuleName.str[:3]
+    df['sensingStart'] = pd.to_datetime(df.granuleName.str[17:32], format=TIME_FORMAT)
+    df['sensingStop'] = pd.to_datetime(df.granuleName.str[33:48], format=TIME_FORMAT)
+    df.sort_values('sensingStart', inplace=True)
+    # NOTE: for equal start times the last (newest) orbit file wins
+    orbits = index.sort_values(['start', 'created'])
+    df = pd.merge_asof(df, orbits, left_on='sensingStart', right_on='start',
+                       by='satellite', direction='backward')
+    df.loc[~(df.stop >= df.sensingStop), ['orbit', 'created', 'start', 'stop']] = None
+
+    return df.drop(columns='satellite')
+
+
+def find_orbit(index, granuleName):
+    '''
+    Newest orbit file whose validity window covers the acquisition
+    None if there isn't one (yet)
+    '''
+    orbit = resolve_orbits([granuleName], index).orbit.iloc[0]
+    return orbit if isinstance(orbit, str) else None
+
+
+def pair_granules(gf, pairs):
+    '''
+    Inventory granules acquired on master or slave dates of pairs
+    (relativeOrbit, master, slave as '%Y%m%d')
+    '''
+    dates = pd.concat([pairs.loc[:, ['relativeOrbit', date]].rename(columns={date: 'date'})
+                       for date in ('master', 'slave')])
+    dates['relativeOrbit'] = dates.relativeOrbit.astype(str)
+    dates['date'] = pd.to_datetime(dates.date.astype(str), format='%Y%m%d')
+    scenes = pd.DataFrame({'relativeOrbit': gf.relativeOrbit.astype(str).values,
+                           'date': gf.dateStamp.values,
+                           'granuleName': gf.granuleName.values})
+    return scenes.merge(dates.drop_duplicates(), on=['relativeOrbit', 'date']).granuleName
+
+
+def orbit_url(granuleName, index=None, url=POEORB_URL):
+    '''
+    Url of precise orbit file for a granule, raises ValueError if none
+    '''
+    if index is None:
+        index = load_orbit_index(url)
+    match = find_orbit(index, granuleName)
+    if match is None:
+        raise ValueError('No precise orbit covering {}'.format(granuleName))
+    return '{}/{}'.format(url, match)
+
+
+def batch_orbits(granules, resorb=False, ttl=INDEX_TTL):
+    '''
+    Orbit file (and url) for each granule, precise where available,
+    restituted for the rest if resorb
+    '''
+    df = resolve_orbits(granules, load_orbit_index(POEORB_URL, ttl))
+    df['url'] = POEORB_URL + '/' + df.orbit
+    missing = df.orbit.isnull()
+    if resorb and missing.any():
+        dfR = resolve_orbits(df.granuleName[missing], load_orbit_index(RESORB_URL, ttl))
+        df.loc[missing, 'orbit'] = dfR.set_index('granuleName').orbit.reindex(
+                                   df.granuleName[missing]).values
+        df.loc[missing, 'url'] = RESORB_URL + '/' + df.orbit[missing]
+
+    return df.loc[:, ['granuleName', 'orbit', 'url']]
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    granules = list(args.granules or [])
+    if args.inventory:
+        gf = load_inventory(args.inventory,
+                            columns=['relativeOrbit', 'dateStamp', 'granuleName'])
+        if args.pairs:
+            pairs = pd.read_csv(args.pairs, dtype=str)
+            granules += pair_granules(gf, pairs).tolist()
+        else:
+            granules += gf.granuleName.tolist()
+    if not granules:
+        index = load_orbit_index(ttl=args.ttl)
+        print(index.groupby('satellite').agg(files=('orbit', 'size'),
+                                             first=('start', 'min'),
+                                             last=('stop', 'max')))
+    else:
+        df = batch_orbits(granules, args.resorb, args.ttl)
+        df.to_csv('orbits.csv', index=False)
+        missing = df.loc[df.orbit.isnull(), 'granuleName']
+        urls = df.url.dropna().unique()
+        print('{} scenes need {} orbit files (orbits.csv)'.format(len(df), len(urls)))
+        if not missing.empty:
+            print('No orbit file for {} scenes:'.format(len(missing)))
+            print('\n'.join(missing))
+        if args.outdir:
+            download_all([make_job(url) for url in urls], args.outdir)
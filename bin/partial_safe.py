@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+'''
+Fetch only the parts of a remote Sentinel-1 SAFE zip needed by topsApp.py
+
+The zip central directory is read with HTTP range requests, then only
+manifest.safe, support schemas, and the annotation, calibration, noise and
+measurement files of the requested swaths and polarization are extracted
+into a local S1*.SAFE directory (zip CRCs are checked on the way). The zip
+is opened once and files are extracted one after another, each read ahead
+block is fetched as -j parallel range requests. A single subswath is
+roughly a third of the full download. Files already extracted are
+skipped, so an interrupted run picks up where it stopped
+
+Examples:
+partial_safe.py -u https://datapool.asf.alaska.edu/SLC/SA/S1A_IW_SLC__1SDV_20170927T014703_20170927T014730_018548_01F42A_66E6.zip -n 2
+partial_safe.py -u http://localhost:8080/files/S1A_IW_SLC__...zip -n 1 2 -l vh
+'''
+import argparse
+import os
+import re
+import shutil
+import zipfile
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+from download_manager import probe
+from http_cache import atomic_open, get_session
+
+# read ahead per range request, large enough that measurement tiffs
+# only take a few hundred requests
+BLOCK_BYTES = 16 * 2**20
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='partial_safe.py')
+    parser.add_argument('-u', type=str, nargs='+', dest='urls', required=True,
+            help='Url(s) of SAFE zip files')
+    parser.add_argument('-n', type=int, nargs='+', dest='swaths', required=False,
+            default=[1,2,3], choices=(1,2,3),
+            help='Subswath numbers to fetch')
+    parser.add_argument('-l', type=str, dest='polarization', required=False,
+            default='vv',
+            help='Polarization to fetch')
+    parser.add_argument('-o', type=str, dest='outdir', required=False,
+            default='.',
+            help='Output directory')
+    parser.add_argument('-j', type=int, dest='workers', required=False,
+            default=4,
+            help='Number of range requests at once')
+
+    return parser.parse_args()
+
+
+class RangeFile(object):
+    '''
+    Read-only, seekable file object over a url, each read not covered by
+    the last block fetches a new block with workers parallel range requests
+    '''
+    def __init__(self, url, session=None, blocksize=BLOCK_BYTES, workers=1):
+        self.url = url
+        self.session = session or get_session(workers)
+        self.blocksize = blocksize
+        self.size, ranges = probe(url, self.session)
+        if not ranges or self.size is None:
+            raise IOError('Range requests not supported: {}'.format(url))
+        self.pos = 0
+        self.block = b''
+        self.blockStart = 0
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.size - self.pos
+        n = min(n, self.size - self.pos)
+        if n <= 0:
+            return b''
+        offset = self.pos - self.blockStart
+        if not (0 <= offset and offset + n <= len(self.block)):
+            stop = min(self.pos + max(n, self.blocksize), self.size)
+            self.block = self.fetch_block(self.pos, stop)
+            self.blockStart = self.pos
+            offset = 0
+        self.pos += n
+        return self.block[offset:offset + n]
+
+    def fetch_block(self, start, stop):
+        ''' Bytes [start, stop) of url, split into parallel requests '''
+        step = -(-(stop - start) // self.workers)
+        if self.pool is None or step < 2**20:
+            return self.fetch(start, stop)
+        starts = range(start, stop, step)
+        parts = self.pool.map(lambda first: self.fetch(first, min(first + step, stop)),
+                              starts)
+        return b''.join(parts)
+
+    def fetch(self, start, stop):
+        ''' Bytes [start, stop) of url '''
+        headers = {'Range': 'bytes={}-{}'.format(start, stop - 1)}
+        r = self.session.get(self.url, headers=headers, timeout=300)
+        r.raise_for_status()
+        if r.status_code != 206 or len(r.content) != stop - start:
+            raise IOError('Bad range response {}-{}: {}'.format(start, stop, self.url))
+        return r.content
+
+    def close(self):
+        self.block = b''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def safe_members(names, swaths=[1,2,3], polarization='vv'):
+    '''
+    Zip members topsApp.py needs for the given swaths and polarization
+    '''
+    swathPattern = re.compile(r'-iw({})-slc-{}-'.format(
+                              '|'.join(str(swath) for swath in swaths),
+                              polarization.lower()))
+    members = []
+    for name in names:
+        if name.endswith('/'):
+            continue
+        parts = name.split('/')
+        if parts[-1] == 'manifest.safe' or 'support' in parts:
+            members.append(name)
+        elif (('annotation' in parts or 'measurement' in parts) and
+              swathPattern.search(parts[-1])):
+            members.append(name)  # includes calibration & noise annotation
+    return members
+
+
+def extract_member(z, info, outdir):
+    '''
+    Extract one zip member (ZipInfo) of open ZipFile z into outdir, skips
+    files already extracted
+    '''
+    outname = os.path.join(outdir, info.filename)
+    if os.path.isfile(outname) and os.path.getsize(outname) == info.file_size:
+        return outname
+    with z.open(info) as src, atomic_open(outname) as dst:
+        shutil.copyfileobj(src, dst, BLOCK_BYTES)
+    return outname
+
+
+def fetch_safe(url, outdir='.', swaths=[1,2,3], polarization='vv', workers=4, session=None):
+    '''
+    Local SAFE directory with only the files needed for swaths and
+    polarization from remote zip at url. returns SAFE path
+    '''
+    session = session or get_session(workers)
+    # NOTE: ZipFile reads share one file position, so members are extracted
+    # in turn through one zip and the parallelism is within each block
+    with closing(RangeFile(url, session, workers=workers)) as f, zipfile.ZipFile(f) as z:
+        infos = {info.filename: info for info in z.infolist()}
+        members = safe_members(infos, swaths, polarization)
+        if not any('/measurement/' in name for name in members):
+            raise ValueError('No measurement files for swaths {} {} in {}'.format(
+                             swaths, polarization, url))
+        nbytes = sum(infos[name].compress_size for name in members)
+        total = sum(info.compress_size for info in infos.values())
+        print('Fetching {:.2f} of {:.2f} GB from {}'.format(nbytes / 1e9, total / 1e9,
+                                                           os.path.basename(url)))
+        for name in members:
+            extract_member(z, infos[name], outdir)
+
+    return os.path.join(outdir, members[0].split('/')[0])
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    session = get_session(args.workers)
+    for url in args.urls:
+        print(fetch_safe(url, args.outdir, args.swaths, args.polarization,
+                         args.workers, session))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''
+Estimate download volume, transfer time and scratch disk before processing,
+using the granule sizes in the ASF metadata (instead of ~5 GB per frame)
+
+Per track: size of the archive. For a list of pairs (e.g. new_pairs.csv
+from get_inventory_asf.py -n, default is all sequential pairs): bytes to
+download if every pair fetches its own SLCs, bytes when dates shared by
+several pairs are only downloaded once, transfer time at a given bandwidth
+and scratch disk for each pair (SLCs times a factor for ISCE products)
+
+Examples:
+plan_capacity.py -i query.geojson -p 115 -b 500
+plan_capacity.py -i query.geojson -l new_pairs.csv
+'''
+import argparse
+import pandas as pd
+
+from inventory import load_inventory, summarize_dates, sequential_pairs
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='plan_capacity.py')
+    parser.add_argument('-i', type=str, dest='inventory', required=True,
+            help='Inventory vector file (query.geojson)')
+    parser.add_argument('-p', type=str, nargs='+', dest='paths', required=False,
+            help='Path/Track/RelativeOrbit Number(s)')
+    parser.add_argument('-l', type=str, dest='pairs', required=False,
+            help='CSV list of pairs (relativeOrbit,master,slave)')
+    parser.add_argument('-b', type=float, dest='bandwidth', required=False,
+            default=100,
+            help='Download bandwidth [Mbit/s]')
+    parser.add_argument('-f', type=float, dest='factor', required=False,
+            default=3,
+            help='Scratch disk per pair as multiple of SLC size')
+
+    return parser.parse_args()
+
+
+def transfer_hours(nbytes, bandwidth=100):
+    ''' Hours to download nbytes at bandwidth [Mbit/s] '''
+    return nbytes * 8 / (bandwidth * 1e6) / 3600
+
+
+def plan_tracks(dates, bandwidth=100):
+    '''
+    Archive size and download time for each track from summarize_dates()
+    '''
+    gb = dates.groupby(level='relativeOrbit')
+    dfT = gb.agg(Dates=('nFrames', 'size'),
+                 Frames=('nFrames', 'sum'))
+    dfT['Bytes'] = gb.nBytes.sum(min_count=1)
+    dfT['GB'] = dfT.Bytes / 1e9
+    dfT['GB/Frame'] = dfT.GB / dfT.Frames
+    dfT['Hours'] = transfer_hours(dfT.Bytes, bandwidth)
+    dfT.index.name = 'Orbit'
+
+    return dfT.drop('Bytes', axis=1)
+
+
+def plan_pairs(dates, pairs, bandwidth=100, factor=3):
+    '''
+    Download size, transfer time and scratch disk for each pair, and
+    totals with and without deduplicating dates shared between pairs
+    '''
+    size = dates.nBytes
+    def date_bytes(orbits, dateStrings):
+        # pair dates are '%Y%m%d', inventory dates '%Y-%m-%d'
+        dateStrings = pd.to_datetime(dateStrings).dt.strftime('%Y-%m-%d')
+        index = pd.MultiIndex.from_arrays([orbits, dateStrings])
+        return size.reindex(index)
+
+    dfP = pairs.loc[:, ['relativeOrbit', 'master', 'slave']].copy()
+    dfP['relativeOrbit'] = dfP.relativeOrbit.astype(str)
+    masterBytes = date_bytes(dfP.relativeOrbit, dfP.master)
+    slaveBytes = date_bytes(dfP.relativeOrbit, dfP.slave)
+    missing = ~(masterBytes.index.isin(size.index) & slaveBytes.index.isin(size.index))
+    if missing.any():
+        print('WARNING: dates not in inventory for {} pairs'.format(missing.sum()))
+    dfP['GB'] = (masterBytes.values + slaveBytes.values) / 1e9
+    dfP['ScratchGB'] = dfP.GB * factor
+    dfP['Hours'] = transfer_hours(dfP.GB * 1e9, bandwidth)
+
+    allDates = pd.concat([masterBytes, slaveBytes])
+    uniqueBytes = allDates[~allDates.index.duplicated()].sum(min_count=1)
+    totals = pd.Series({'Pairs': len(dfP),
+                        'Download GB (per pair)': dfP.GB.sum(min_count=1),
+                        'Download GB (deduplicated)': uniqueBytes / 1e9,
+                        'Transfer hours (deduplicated)': transfer_hours(uniqueBytes, bandwidth),
+                        'Max scratch GB per pair': dfP.ScratchGB.max(),
+                        'Scratch GB (all pairs)': dfP.ScratchGB.sum()})
+
+    return dfP, totals
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    gf = load_inventory(args.inventory)
+    if args.paths:
+        gf = gf.loc[gf.relativeOrbit.astype(str).isin(args.paths)]
+    dates = summarize_dates(gf)
+    if dates.nBytes.isnull().all():
+        print('WARNING: no bytes or sizeMB in inventory, sizes are unknown')
+
+    dfT = plan_tracks(dates, args.bandwidth)
+    dfT.to_csv('capacity_tracks.csv')
+    print(dfT.round(2))
+
+    if args.pairs:
+        pairs = pd.read_csv(args.pairs, dtype=str)
+        if args.paths:
+            pairs = pairs.loc[pairs.relativeOrbit.isin(args.paths)]
+    else:
+        pairs = sequential_pairs(dates)
+    dfP, totals = plan_pairs(dates, pairs, args.bandwidth, args.factor)
+    dfP.to_csv('capacity_pairs.csv', index=False)
+    print(totals.round(2).to_string())
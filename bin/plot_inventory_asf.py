@@ -2,24 +2,43 @@
 '''
 Plot inventory polygon extents on a map & separate figure with timeline
 
+Figures are rendered headless (Agg) in parallel worker processes, and are
+saved next to each inventory, so one call can produce reports for many ROIs
+
+Examples:
+plot_inventory_asf.py -i query.geojson
+plot_inventory_asf.py -i */query.geojson -t -j 8
+
 Author: Scott Henderson
 Date: 10/2017
 ISCE: 2.1.0
 '''
 import argparse
+import os
 import geopandas as gpd
 import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.patheffects as PathEffects
+from matplotlib.lines import Line2D
 from  matplotlib.dates import YearLocator, MonthLocator, DateFormatter
 
 from pandas.plotting import table
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
-from cartopy.io.img_tiles import GoogleTiles
 
-from owslib.wmts import WebMapTileService
+import inventory
+from http_cache import write_atomic
+from inventory import summarize_dates, summarize_tracks
+
+# above this many scenes, timelines show one marker per track and date
+AGGREGATE_SCENES = 20000
+# above this many markers, marker layers are stored as images in the PDF
+RASTERIZE_MARKERS = 2000
+MARKERS = {'Sentinel-1A':'o', 'Sentinel-1B':'d'}
+# track outlines on map are simplified to this tolerance [degrees], ~1 km
+TRACK_TOLERANCE = 0.01
 
 
 def cmdLineParse():
@@ -27,27 +46,28 @@ def cmdLineParse():
     Command line parser.
     '''
     parser = argparse.ArgumentParser(description='plot_inventory_asf.py')
-    parser.add_argument('-i', type=str, dest='input', required=True,
-                help='Vector inventory (query.geojson)')
+    parser.add_argument('-i', type=str, nargs='+', dest='input', required=True,
+                help='Vector inventory (query.geojson), one per directory')
     parser.add_argument('-p', type=str, dest='polygon', required=False,
             help='Polygon defining region of interest')
+    parser.add_argument('-t', action='store_true', default=False, dest='table', required=False,
+            help='Also plot timeline with summary table')
+    parser.add_argument('-j', type=int, dest='workers', required=False,
+            default=os.cpu_count(),
+            help='Number of figures rendered in parallel')
 
 
     return parser.parse_args()
 
 
-def load_inventory(vectorFile):
+def load_inventory(vectorFile, columns=None):
     '''
-    load merged inventory. easy!
+    load merged inventory, with integer relative orbits sorted for plotting
     '''
-    gf = gpd.read_file(vectorFile)
-    gf['timeStamp'] = gpd.pd.to_datetime(gf.sceneDate, format='%Y-%m-%d %H:%M:%S')
-    gf['sceneDateString'] = gf.timeStamp.apply(lambda x: x.strftime('%Y-%m-%d'))
-    gf['dateStamp'] = gpd.pd.to_datetime(gf.sceneDateString)
-    gf['utc'] = gf.timeStamp.apply(lambda x: x.strftime('%H:%M:%S'))
+    gf = inventory.load_inventory(vectorFile, columns)
     gf['relativeOrbit'] = gf.relativeOrbit.astype('int')
     gf.sort_values('relativeOrbit', inplace=True)
-    gf['orbitCode'] = gf.relativeOrbit.astype('category').cat.codes
+    inventory.add_orbit_code(gf)
     return gf
 
 
@@ -59,10 +79,47 @@ def ogr2snwe(vectorFile):
     return [S,N,W,E]
 
 
-def plot_map(gf, snwe, vectorFile=None, zoom=6):
+def track_unions(gf, vectorFile=None, tolerance=TRACK_TOLERANCE):
+    '''
+    Footprint union of each track (one bulk dissolve), simplified to display
+    tolerance [degrees], with label position and bounds of the unsimplified
+    union. saved next to the inventory (query_tracks.geojson) and reused
+    while newer than vectorFile
+    '''
+    if vectorFile:
+        trackFile = os.path.splitext(vectorFile)[0] + '_tracks.geojson'
+        if (os.path.isfile(trackFile) and
+            os.path.getmtime(trackFile) >= os.path.getmtime(vectorFile)):
+            tracks = gpd.read_file(trackFile)
+            if np.allclose(tracks.tolerance, tolerance):
+                return tracks.set_index('relativeOrbit')
+
+    columns = ['relativeOrbit', 'flightDirection', 'geometry']
+    tracks = gf.loc[:, columns].dissolve(by='relativeOrbit', aggfunc='first')
+    tracks = tracks.join(tracks.bounds)
+    tracks['xpos'] = [poly.centroid.x for poly in tracks.geometry]
+    tracks['ypos'] = tracks.miny.where(tracks.flightDirection == 'DESCENDING',
+                                       tracks.maxy)
+    tracks['geometry'] = tracks.simplify(tolerance)
+    tracks['tolerance'] = tolerance
+
+    if vectorFile:
+        write_atomic(trackFile, tracks.reset_index().to_json(), 'w')
+
+    return tracks
+
+
+def plot_map(gf, snwe, vectorFile=None, zoom=6, tracks=None,
+             outname='map_coverage.pdf'):
     '''
     Use Stamen Terrain background
+    optional tracks from track_unions() avoids recomputing them
     '''
+    # NOTE: imported here so timeline-only workers don't pay for cartopy
+    import cartopy.crs as ccrs
+    from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
+    import tile_cache
+
     pad = 1 #degrees
     S,N,W,E = snwe
     plot_CRS = ccrs.PlateCarree()
@@ -83,22 +140,24 @@ def plot_map(gf, snwe, vectorFile=None, zoom=6):
     # NOTE: going higher than zoom=8 is slow...
     # How to get appropriate zoom level for static map?
     #ax.add_image(tiler, zoom)
-    URL = 'http://gibs.earthdata.nasa.gov/wmts/epsg4326/best/wmts.cgi'
-    wmts = WebMapTileService(URL)
+    # tiles & natural earth features are cached locally, see tile_cache.py
+    wmts = tile_cache.CachedWMTS(tile_cache.GIBS_URL)
+    tile_cache.use_natural_earth_cache()
     #layer = 'ASTER_GDEM_Greyscale_Shaded_Relief' #ASTER_GDEM_Color_Shaded_Relief # for small regions
     layer = 'BlueMarble_ShadedRelief_Bathymetry' #BlueMarble_ShadedRelief, BlueMarble_NextGeneration
     ax.add_wmts(wmts, layer)
 
-    states_provinces = cfeature.NaturalEarthFeature(
-        category='cultural',
-        name='admin_1_states_provinces_lines',
-        scale='110m',
+    # NOTE: fixed scales from tile_cache.NATURAL_EARTH, so seeded files are used
+    states_provinces = tile_cache.natural_earth_feature(
+        'admin_1_states_provinces_lines',
         facecolor='none')
     ax.add_feature(states_provinces, edgecolor='k', linestyle=':')
 
-    #ax.add_feature(cfeature.COASTLINE)
-    ax.coastlines(resolution='10m', color='black', linewidth=2)
-    ax.add_feature(cfeature.BORDERS)
+    coastline = tile_cache.natural_earth_feature('coastline', facecolor='none')
+    ax.add_feature(coastline, edgecolor='black', linewidth=2)
+    borders = tile_cache.natural_earth_feature('admin_0_boundary_lines_land',
+                                               facecolor='none')
+    ax.add_feature(borders, edgecolor='black')
 
 
     # Add region of interest polygon in specified
@@ -112,31 +171,24 @@ def plot_map(gf, snwe, vectorFile=None, zoom=6):
                           linestyle='dashed')
 
     #gf = load_inventory(args.input)
-    orbits = gf.relativeOrbit.unique()
-    colors = plt.cm.jet(np.linspace(0,1,orbits.size))
+    if tracks is None:
+        tracks = track_unions(gf)
+    colors = plt.cm.jet(np.linspace(0,1,len(tracks)))
 
     #colors = plt.get_cmap('jet', orbits.size) #not iterable
-    for orbit,color in zip(orbits, colors):
-        df = gf.query('relativeOrbit == @orbit')
-        poly = df.geometry.cascaded_union
-
-        if df.flightDirection.iloc[0] == 'ASCENDING':
+    for (orbit,track),color in zip(tracks.iterrows(), colors):
+        if track.flightDirection == 'ASCENDING':
             linestyle = '--'
-            #xpos, ypos = poly.bounds[0], poly.bounds[3] #upper left
-            xpos,ypos = poly.centroid.x, poly.bounds[3]
         else:
             linestyle = '-'
-            #xpos, ypos = poly.bounds[2], poly.bounds[1] #lower right
-            xpos,ypos = poly.centroid.x, poly.bounds[1]
 
-
-        ax.add_geometries([poly],
+        ax.add_geometries([track.geometry],
                           ccrs.PlateCarree(),
                           facecolor='none',
                           edgecolor=color,
                           lw=2, #no effect?
                           linestyle=linestyle)
-        ax.text(xpos, ypos, orbit, color=color, fontsize=16, fontweight='bold', transform=geodetic_CRS)
+        ax.text(track.xpos, track.ypos, orbit, color=color, fontsize=16, fontweight='bold', transform=geodetic_CRS)
 
     gl = ax.gridlines(plot_CRS, draw_labels=True,
                       linewidth=0.5, color='gray', alpha=0.5, linestyle='-')
@@ -149,44 +201,82 @@ def plot_map(gf, snwe, vectorFile=None, zoom=6):
 
     plt.title('Sentinel-1 Orbits')
     #plt.show()
-    plt.savefig('map_coverage.pdf', bbox_inches='tight')
+    plt.savefig(outname, bbox_inches='tight')
+    plt.close(fig)
+
+
+def timeline_points(gf, dates=None, aggregate=AGGREGATE_SCENES):
+    '''
+    Date, orbit code, platform, direction and marker size for each timeline
+    marker. inventories with more than aggregate scenes get one marker per
+    track and date from summarize_dates(), sized by number of frames
+    '''
+    if len(gf) <= aggregate:
+        return pd.DataFrame({'time': gf.timeStamp.values,
+                             'orbitCode': gf.orbitCode.values,
+                             'platform': gf.platform.values,
+                             'flightDirection': gf.flightDirection.values,
+                             'size': 60})
+    if dates is None:
+        dates = summarize_dates(gf)
+    categories = gf.relativeOrbit.astype('category').cat.categories
+    orbits = dates.index.get_level_values('relativeOrbit')
+    return pd.DataFrame({'time': dates.dateStamp.values,
+                         'orbitCode': pd.Categorical(orbits, categories).codes,
+                         'platform': dates.platform.values,
+                         'flightDirection': dates.flightDirection.values,
+                         'size': 30 * dates.nFrames.clip(upper=4).values})
+
+
+def scatter_timeline(ax, gf, dates=None, aggregate=AGGREGATE_SCENES,
+                     rasterize=RASTERIZE_MARKERS):
+    '''
+    Acquisitions by date and orbit (same colors as map). ascending markers
+    are hollow, descending filled, one scatter call per platform. dense
+    marker layers are rasterized so PDF size doesn't grow with inventory
+    '''
+    points = timeline_points(gf, dates, aggregate)
+    colors = plt.cm.jet(np.linspace(0,1, gf.relativeOrbit.nunique()))
+    edgecolors = colors[points.orbitCode.values]
+    facecolors = edgecolors.copy()
+    facecolors[(points.flightDirection == 'ASCENDING').values] = 0 #transparent
+    rasterized = len(points) > rasterize
+    for platform,marker in MARKERS.items():
+        ind = (points.platform == platform).values
+        if ind.any():
+            ax.scatter(points.time.values[ind], points.orbitCode.values[ind],
+                       s=points['size'].values[ind], marker=marker,
+                       facecolors=facecolors[ind], edgecolors=edgecolors[ind],
+                       rasterized=rasterized)
+
+    # NOTE: each scatter mixes directions, so legend needs proxy artists
+    handles = [Line2D([], [], linestyle='none', marker=marker, markersize=8,
+                      markeredgecolor='k', markerfacecolor=face,
+                      label='{} S1{}'.format(direction, platform[-1]))
+               for direction,face in (('Asc','none'), ('Dsc','k'))
+               for platform,marker in MARKERS.items()]
+
+    categories = gf.relativeOrbit.astype('category').cat.categories
+    plt.yticks(np.arange(categories.size), categories)
+    ax.xaxis.set_minor_locator(MonthLocator())
+    ax.xaxis.set_major_locator(YearLocator())
 
+    return handles
 
-def plot_timeline_table(gf):
+
+def plot_timeline_table(gf, dates=None, outname='timeline_with_table.pdf'):
     '''
     Timeline with summary table
+    optional dates table from summarize_dates() avoids recomputing it
     '''
-    dfA = gf.query('platform == "Sentinel-1A"')
-    dfAa = dfA.query(' flightDirection == "ASCENDING" ')
-    dfAd = dfA.query(' flightDirection == "DESCENDING" ')
-    dfB = gf.query('platform == "Sentinel-1B"')
-    dfBa = dfB.query(' flightDirection == "ASCENDING" ')
-    dfBd = dfB.query(' flightDirection == "DESCENDING" ')
-
-    # summary table
-    dfS = pd.DataFrame(index=gf.relativeOrbit.unique())
-    dfS['Start'] = gf.groupby('relativeOrbit').sceneDateString.min()
-    dfS['Stop'] =  gf.groupby('relativeOrbit').sceneDateString.max()
-    dfS['Dates'] = gf.groupby('relativeOrbit').sceneDateString.nunique()
-    dfS['Frames'] = gf.groupby('relativeOrbit').sceneDateString.count()
-    dfS['Direction'] = gf.groupby('relativeOrbit').flightDirection.first()
-    dfS['UTC'] = gf.groupby('relativeOrbit').utc.first()
-    dfS.sort_index(inplace=True, ascending=False)
-    dfS.index.name = 'Orbit'
-
-    # Same colors as map
-    orbits = gf.relativeOrbit.unique()
-    colors = plt.cm.jet(np.linspace(0,1, orbits.size))
+    # summary table (same as inventory_summary.csv)
+    if dates is None:
+        dates = summarize_dates(gf)
+    dfS = summarize_tracks(dates)
+    norbits = gf.relativeOrbit.nunique()
 
     fig,ax = plt.subplots(figsize=(11,8.5))
-    #plt.scatter(dfA.timeStamp.values, dfA.orbitCode.values, c=dfA.orbitCode.values, cmap='jet', s=60, label='S1A')
-    #plt.scatter(dfB.timeStamp.values, dfB.orbitCode.values, c=dfB.orbitCode.values, cmap='jet', s=60, marker='d',label='S1B')
-    plt.scatter(dfAa.timeStamp.values, dfAa.orbitCode.values, c=colors[dfAa.orbitCode.values], cmap='jet', s=60, facecolor='none', label='S1A')
-    plt.scatter(dfBa.timeStamp.values, dfBa.orbitCode.values, c=colors[dfBa.orbitCode.values], cmap='jet', s=60, facecolor='none', marker='d',label='S1B')
-    plt.scatter(dfAd.timeStamp.values, dfAd.orbitCode.values, c=colors[dfAd.orbitCode.values], cmap='jet', s=60, label='S1A')
-    plt.scatter(dfBd.timeStamp.values, dfBd.orbitCode.values, c=colors[dfBd.orbitCode.values], cmap='jet', s=60, marker='d',label='S1B')
-
-    plt.yticks(gf.orbitCode.unique(), gf.relativeOrbit.unique())
+    handles = scatter_timeline(ax, gf, dates)
     #plt.axvline('2016-04-22', color='gray', linestyle='dashed', label='Sentinel-1B launch')
 
     # Add to plot! as a custom legend
@@ -194,53 +284,67 @@ def plot_timeline_table(gf):
           cellLoc = 'center', rowLoc = 'center',
           bbox=[0.1, 0.7, 0.6, 0.3] )#[left, bottom, width, height])
 
-    ax.xaxis.set_minor_locator(MonthLocator())
-    ax.xaxis.set_major_locator(YearLocator())
-    plt.legend(loc='upper right')
-    plt.ylim(-1,orbits.size+3)
+    plt.legend(handles=handles, loc='upper right')
+    plt.ylim(-1,norbits+3)
     plt.ylabel('Orbit Number')
     fig.autofmt_xdate()
     plt.title('Sentinel-1 timeline')
-    plt.savefig('timeline_with_table.pdf', bbox_inches='tight')
+    plt.savefig(outname, bbox_inches='tight', dpi=200)
+    plt.close(fig)
 
-def plot_timeline(gf):
+def plot_timeline(gf, dates=None, outname='timeline.pdf'):
     '''
-    Timeline with summary table
+    Timeline of acquisitions for each orbit
     '''
-    dfA = gf.query('platform == "Sentinel-1A"')
-    dfAa = dfA.query(' flightDirection == "ASCENDING" ')
-    dfAd = dfA.query(' flightDirection == "DESCENDING" ')
-    dfB = gf.query('platform == "Sentinel-1B"')
-    dfBa = dfB.query(' flightDirection == "ASCENDING" ')
-    dfBd = dfB.query(' flightDirection == "DESCENDING" ')
-
-
-    # Same colors as map
-    orbits = gf.relativeOrbit.unique()
-    colors = plt.cm.jet(np.linspace(0,1, orbits.size))
+    norbits = gf.relativeOrbit.nunique()
 
     fig,ax = plt.subplots(figsize=(11,8.5))
-    plt.scatter(dfAa.timeStamp.values, dfAa.orbitCode.values, edgecolors=colors[dfAa.orbitCode.values], facecolors='None', cmap='jet', s=60, label='Asc S1A')
-    plt.scatter(dfBa.timeStamp.values, dfBa.orbitCode.values, edgecolors=colors[dfBa.orbitCode.values], facecolors='None', cmap='jet', s=60, marker='d',label='Asc S1B')
-    plt.scatter(dfAd.timeStamp.values, dfAd.orbitCode.values, c=colors[dfAd.orbitCode.values], cmap='jet', s=60, label='Dsc S1A')
-    plt.scatter(dfBd.timeStamp.values, dfBd.orbitCode.values, c=colors[dfBd.orbitCode.values], cmap='jet', s=60, marker='d',label='Dsc S1B')
-
-    plt.yticks(gf.orbitCode.unique(), gf.relativeOrbit.unique())
+    handles = scatter_timeline(ax, gf, dates)
 
-    ax.xaxis.set_minor_locator(MonthLocator())
-    ax.xaxis.set_major_locator(YearLocator())
-    plt.legend(loc='lower right')
-    plt.ylim(-1,orbits.size)
+    plt.legend(handles=handles, loc='lower right')
+    plt.ylim(-1,norbits)
     plt.ylabel('Orbit Number')
     fig.autofmt_xdate()
     plt.title('Sentinel-1 timeline')
-    plt.savefig('timeline.pdf', bbox_inches='tight')
+    plt.savefig(outname, bbox_inches='tight', dpi=200)
+    plt.close(fig)
+
+
+def render(task):
+    '''
+    Render one figure ('map', 'timeline' or 'table') of one inventory,
+    saved in the inventory directory. returns output file
+    '''
+    kind, vectorFile, polygon = task
+    outdir = os.path.dirname(os.path.abspath(vectorFile))
+    gf = load_inventory(vectorFile)
+    if kind == 'map':
+        tracks = track_unions(gf, vectorFile)
+        w,s,e,n = tracks.minx.min(), tracks.miny.min(), tracks.maxx.max(), tracks.maxy.max()
+        snwe = [s,n,w,e]
+        outname = os.path.join(outdir, 'map_coverage.pdf')
+        plot_map(gf, snwe, polygon, tracks=tracks, outname=outname)
+    elif kind == 'timeline':
+        outname = os.path.join(outdir, 'timeline.pdf')
+        plot_timeline(gf, outname=outname)
+    else:
+        outname = os.path.join(outdir, 'timeline_with_table.pdf')
+        plot_timeline_table(gf, outname=outname)
+    return outname
 
 
 if __name__ == '__main__':
     args = cmdLineParse()
-    gf = load_inventory(args.input)
-    w,s,e,n = gf.geometry.cascaded_union.bounds
-    snwe = [s,n,w,e]
-    plot_map(gf, snwe, args.polygon)
-    plot_timeline(gf)
+    outdirs = [os.path.dirname(os.path.abspath(f)) for f in args.input]
+    if len(set(outdirs)) < len(outdirs):
+        raise ValueError('Figures would overwrite each other, use one inventory per directory')
+    kinds = ['map', 'timeline'] + (['table'] if args.table else [])
+    tasks = [(kind, vectorFile, args.polygon) for vectorFile in args.input for kind in kinds]
+
+    if args.workers == 1:
+        for outname in map(render, tasks):
+            print(outname)
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(tasks))) as pool:
+            for outname in pool.map(render, tasks):
+                print(outname)
@@ -5,7 +5,9 @@ with topsApp.py (ISCE 2.1.0)
 
 Examples:
 # process just subswaths 1 and 2
-prep_topsApp.py -i query.geojson -m 20160910 -s 20160724
+prep_topsApp.py -i query.geojson -m 20160910 -s 20160724 -n 1 2
+# only download subswath 2 files (SAFE directories instead of zips)
+prep_topsApp.py -i query.geojson -m 20160910 -s 20160724 -n 2 -z
 
 Author Scott Henderson
 Updated: 10/2017
@@ -13,9 +15,14 @@ Updated: 10/2017
 import argparse
 import os
 import glob
-import geopandas as gpd
-from lxml import html
-import requests
+
+from download_manager import inventory_jobs
+from auxcal_sync import sync_auxcal
+from http_cache import download_file
+from inventory import load_inventory
+from orbit_index import orbit_url
+from partial_safe import fetch_safe
+from slc_cache import fetch_all
 
 import isce
 from isceobj.XmlUtil import FastXML as xml
@@ -51,95 +58,59 @@ def cmdLineParse():
     parser.add_argument('-g', type=float, nargs=4, dest='gbox', required=False,
             metavar=('S','N','W','E'),
 	        help='Geocode bbox [S,N,W,E]')
+    parser.add_argument('-z', action='store_true', default=False, dest='partial', required=False,
+            help='Only fetch files for selected subswaths from remote zips')
+    parser.add_argument('-l', type=str, dest='polarization', required=False,
+            default='vv',
+            help='Polarization to fetch with -z')
 
     return parser.parse_args()
 
 
-
-def download_scene(downloadUrl):
-    '''
-    aria2c --http-auth-challenge=true --http-user=CHANGE_ME --http-passwd='CHANGE_ME' "https://api.daac.asf.alaska.edu/services/search/param?granule_list=S1A_EW_GRDM_1SDH_20151003T040339_20151003T040351_007983_00B2A6_7377&output=metalink"
-    '''
-    print('pwd:', os.getcwd())
-    print('Downloading frame from ASF...')
-    print('Requires ~/.netrc file:  ')
-    print('See: https://winsar.unavco.org/software/release_note_isce-2.1.0.txt')
-    cmd = 'wget -q -nc -c {}'.format(downloadUrl) #nc won't overwrite. -c continuous if unfinished -q is for 'quiet mode' since many incremental download % updates go to /var/log/cloud-init-output.log
-    print(cmd)
-    os.system(cmd)
-    print('Done downloading')
-
-
-def load_inventory(vectorFile):
-    '''
-    load merged inventory. easy!
-    '''
-    gf = gpd.read_file(vectorFile)
-    gf['timeStamp'] = gpd.pd.to_datetime(gf.sceneDate, format='%Y-%m-%d %H:%M:%S')
-    gf['sceneDateString'] = gf.timeStamp.apply(lambda x: x.strftime('%Y-%m-%d'))
-    gf['dateStamp'] = gpd.pd.to_datetime(gf.sceneDateString)
-    gf['utc'] = gf.timeStamp.apply(lambda x: x.strftime('%H:%M:%S'))
-    gf['orbitCode'] = gf.relativeOrbit.astype('category').cat.codes
-    return gf
-
-
 def download_orbit(granuleName):
     '''
-    Grab orbit files from ASF
+    Grab orbit files from ASF, matched with the local orbit index
     '''
-    cwd = os.getcwd()
     try:
-        os.chdir(os.environ['POEORB'])
-        sat = granuleName[:3]
-        date = granuleName[17:25]
-        print('downloading orbit for {}, {}'.format(sat,date))
-
-        url = 'https://s1qc.asf.alaska.edu/aux_poeorb'
-        r = requests.get(url)
-        webpage = html.fromstring(r.content)
-        orbits = webpage.xpath('//a/@href')
-        # get s1A or s1B
-        df = gpd.pd.DataFrame(dict(orbit=orbits))
-        dfSat = df[df.orbit.str.startswith(sat)]
-        dayBefore = gpd.pd.to_datetime(date) - gpd.pd.to_timedelta(1, unit='d')
-        dayBeforeStr = dayBefore.strftime('%Y%m%d')
-        # get matching orbit file
-        dfSat['startTime'] = dfSat.orbit.str[42:50]
-        match = dfSat.loc[dfSat.startTime == dayBeforeStr, 'orbit'].values[0]
-        cmd = 'wget -q -nc {}/{}'.format(url,match) #-nc means no clobber
-        print(cmd)
-        os.system(cmd)
+        print('downloading orbit for {}'.format(granuleName))
+        url = orbit_url(granuleName)
+        print(url)
+        download_file(url, os.environ['POEORB'])
     except Exception as e:
         print('Trouble downloading POEORB... maybe scene is too recent?')
         print(e)
         pass
-    os.chdir(cwd) #NOTE: best to specifiy download dir instead of jumping cwd around...
 
 
-def download_auxcal():
+def download_auxcal(granules, processingDates=None):
     '''
-    Auxilary data files <20Mb, just download all of them!
-    NOTE: probably can be simplified! see download_orbit
+    Auxilary data files <20Mb, only the ones these scenes need
+    (listing crawled at most daily, existing files kept, see auxcal_sync.py)
     '''
-    cwd = os.getcwd()
-    os.chdir(os.environ['AUXCAL'])
-    print('Downloading S1 AUXILARY DATA...')
-    url = 'https://s1qc.asf.alaska.edu/aux_cal'
-    cmd = 'wget -q -r -l2 -nc -nd -np -nH -A SAFE {}'.format(url)
-    print(cmd)
-    os.system(cmd)
-    os.chdir(cwd)
+    print('Syncing S1 AUXILARY DATA...')
+    sync_auxcal(granules, processingDates, auxdir=os.environ['AUXCAL'])
 
 
-def find_scenes(gf, dateStr, relativeOrbit, download=True):
+def find_scenes(gf, dateStr, relativeOrbit, download=True, swaths=None, polarization='vv'):
     '''
     Get downloadUrls for a given date
+    with swaths, only the files needed for those swaths are fetched into
+    SAFE directories (partial_safe.py), which are returned instead of zips
     '''
     GF = gf.query('relativeOrbit == @relativeOrbit')
     GF = GF.loc[ GF.dateStamp == dateStr ]
     if download:
-        for i,row in GF.iterrows():
-            download_scene(row.downloadUrl)
+        download_auxcal(GF.granuleName, GF.processingDate)
+    if swaths:
+        safes = [fetch_safe(url, swaths=swaths, polarization=polarization)
+                 for url in GF.downloadUrl]
+        download_orbit(GF.granuleName.iloc[0])
+        print('SCENES: ', safes)
+        return safes
+    if download:
+        # frames shared with other pairs come from the SLC cache, see slc_cache.py
+        print('Linking {} frames from SLC cache...'.format(len(GF)))
+        fetch_all(inventory_jobs(GF))
         download_orbit(GF.granuleName.iloc[0])
 
     filenames = GF.fileName.tolist()
@@ -195,20 +166,24 @@ if __name__ == '__main__':
         os.environ['AUXCAL'] = './'
 
     inps = cmdLineParse()
-    gf = load_inventory(inps.inventory)
+    gf = load_inventory(inps.inventory,
+                        columns=['relativeOrbit','dateStamp','downloadUrl','granuleName','fileName',
+                                 'bytes','md5sum','processingDate'])
     intdir = 'int-{0}-{1}'.format(inps.master, inps.slave)
     if not os.path.isdir(intdir):
         os.mkdir(intdir)
     os.chdir(intdir)
-    download_auxcal()
+    swaths = inps.swaths if inps.partial else None
     try:
-        inps.master_scenes = find_scenes(gf, inps.master, inps.path, download=True)
+        inps.master_scenes = find_scenes(gf, inps.master, inps.path, download=True,
+                                         swaths=swaths, polarization=inps.polarization)
     except Exception as e:
         print('ERROR retrieving master scenes, double check dates:')
         #print(e)
         raise
     try:
-        inps.slave_scenes = find_scenes(gf, inps.slave, inps.path, download=True)
+        inps.slave_scenes = find_scenes(gf, inps.slave, inps.path, download=True,
+                                        swaths=swaths, polarization=inps.polarization)
     except Exception as e:
         print('ERROR retrieving slave scenes, double check dates:')
         raise
@@ -12,11 +12,11 @@ Updated: 02/2018
 import argparse
 import os
 import glob
-import geopandas as gpd
-from lxml import html
-import requests
 # Borrowed from Piyush Agram:
 import FastXML as xml
+from download_manager import make_job, write_manifest
+from inventory import load_inventory
+from orbit_index import load_orbit_index, orbit_url
 
 
 def cmdLineParse():
@@ -49,42 +49,11 @@ def cmdLineParse():
     return parser.parse_args()
 
 
-def load_inventory(vectorFile):
+def get_orbit_url(granuleName, index=None):
     '''
-    load merged (S1A and S1B) inventory
+    Precise orbit file url from the local orbit index, see orbit_index.py
     '''
-    gf = gpd.read_file(vectorFile)
-    gf['timeStamp'] = gpd.pd.to_datetime(gf.sceneDate, format='%Y-%m-%d %H:%M:%S')
-    gf['sceneDateString'] = gf.timeStamp.apply(lambda x: x.strftime('%Y-%m-%d'))
-    gf['dateStamp'] = gpd.pd.to_datetime(gf.sceneDateString)
-    gf['utc'] = gf.timeStamp.apply(lambda x: x.strftime('%H:%M:%S'))
-    gf['orbitCode'] = gf.relativeOrbit.astype('category').cat.codes
-    return gf
-
-
-def get_orbit_url(granuleName):
-    '''
-    Grab orbit files from ASF
-    '''
-    sat = granuleName[:3]
-    date = granuleName[17:25]
-    #print('downloading orbit for {}, {}'.format(sat,date))
-    # incomplete inventory 'https://s1qc.asf.alaska.edu/aux_poeorb/files.txt'
-    url = 'https://s1qc.asf.alaska.edu/aux_poeorb'
-    r = requests.get(url)
-    webpage = html.fromstring(r.content)
-    orbits = webpage.xpath('//a/@href')
-    # get s1A or s1B
-    df = gpd.pd.DataFrame(dict(orbit=orbits))
-    dfSat = df[df.orbit.str.startswith(sat)].copy()
-    dayBefore = gpd.pd.to_datetime(date) - gpd.pd.to_timedelta(1, unit='d')
-    dayBeforeStr = dayBefore.strftime('%Y%m%d')
-    # get matching orbit file
-    dfSat.loc[:, 'startTime'] = dfSat.orbit.str[42:50]
-    match = dfSat.loc[dfSat.startTime == dayBeforeStr, 'orbit'].values[0]
-    orbitUrl = f'{url}/{match}'
-
-    return orbitUrl
+    return orbit_url(granuleName, index)
 
 
 def get_slc_urls(gf, dateStr, relativeOrbit):
@@ -110,6 +79,19 @@ def write_wget_download_file(fileList):
         f.write("\n".join(fileList))
 
 
+def write_download_manifest(gf, fileList):
+    '''
+    Same urls as download-links.txt with ASF sizes & checksums, for
+    download_manager.py (orbit files have neither)
+    '''
+    slcs = gf.loc[gf.downloadUrl.isin(fileList)].drop_duplicates('downloadUrl')
+    slcs = slcs.set_index('downloadUrl')
+    jobs = [make_job(url) if url not in slcs.index
+            else make_job(url, slcs.at[url, 'bytes'], slcs.at[url, 'md5sum'])
+            for url in fileList]
+    write_manifest(jobs, 'download-manifest.csv')
+
+
 
 def write_topsApp_xml(inps):
     ''' use built in isce utility to write XML programatically (based on unoffical isce guide Sep2014'''
@@ -149,7 +131,8 @@ def write_topsApp_xml(inps):
 
 if __name__ == '__main__':
     inps = cmdLineParse()
-    gf = load_inventory(inps.inventory)
+    gf = load_inventory(inps.inventory,
+                        columns=['relativeOrbit','dateStamp','downloadUrl','bytes','md5sum'])
     intdir = 'int-{0}-{1}'.format(inps.master, inps.slave)
     if not os.path.isdir(intdir):
         os.mkdir(intdir)
@@ -163,10 +146,11 @@ if __name__ == '__main__':
 
     if inps.poeorb:
         try:
+            index = load_orbit_index()
             frame = os.path.basename(inps.master_scenes[0])
-            downloadList.append(get_orbit_url(frame))
+            downloadList.append(get_orbit_url(frame, index))
             frame = os.path.basename(inps.slave_scenes[0])
-            downloadList.append(get_orbit_url(frame))
+            downloadList.append(get_orbit_url(frame, index))
         except Exception as e:
             print('Trouble downloading POEORB... maybe scene is too recent?')
             print('Falling back to using header orbits')
@@ -177,6 +161,7 @@ if __name__ == '__main__':
     write_topsApp_xml(inps)
 
     write_wget_download_file(downloadList)
+    write_download_manifest(gf, downloadList)
 
     cmd = f'aws s3 mb s3://{intdir}'
     print(cmd)
@@ -109,7 +109,7 @@ Resources:
           export PATH=/mnt/data/dinoSAR/bin:$PATH
           echo $PATH
           # Download inventory file
-          get_inventory_asf.py -r {roi}
+          get_inventory_asf.py -r {roi} -p {path}
           # Prepare interferogram directory
           prep_topsApp.py -i query.geojson -p {path} -m {master} -s {slave} -n {swaths} -r {roi} -g {gbox}
           # Run code
@@ -20,10 +20,24 @@ echo $PWD
 aws s3 sync s3://$INTNAME .
 
 # Download S1 SLCs from asf
-wget --user=$NASAUSER --password=$NASAPASS --input-file=download-links.txt
+if [ -f download-manifest.csv ]; then
+  # parallel, resumable, checksum-verified (Earthdata login from ~/.netrc)
+  if [ ! -f ~/.netrc ]; then
+    echo "machine urs.earthdata.nasa.gov login $NASAUSER password $NASAPASS" > ~/.netrc
+    chmod 600 ~/.netrc
+  fi
+  download_manager.py -i download-manifest.csv -j 4 -c 4
+else
+  wget --user=$NASAUSER --password=$NASAPASS --input-file=download-links.txt
+fi
 
 # Download aux-cal 20Mb, needed for antenna pattern on old IPF conversions :(
-wget -q -r -l2 -nc -nd -np -nH -A SAFE https://s1qc.asf.alaska.edu/aux_cal
+# only files for these scenes, AUXCAL can be a volume shared between jobs
+if [ -f download-manifest.csv ]; then
+  auxcal_sync.py -i download-manifest.csv -a ${AUXCAL:-.} -o .
+else
+  wget -q -r -l2 -nc -nd -np -nH -A SAFE https://s1qc.asf.alaska.edu/aux_cal
+fi
 
 # Run ISCE Software
 topsApp.py 2>&1 | tee topsApp.log
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+'''
+Shared SLC cache for interferogram directories
+
+Frames are downloaded once (with download_manager.py) into
+$DINOSAR_SLC_CACHE (default ~/.cache/dinosar/slc, can be a mounted shared
+volume), keyed by granule name and md5sum, and hardlinked into each
+int-{master}-{slave} directory (symlinked across filesystems). A date used
+by several pairs is only downloaded once. Least recently used frames are
+removed once the cache exceeds $DINOSAR_SLC_CACHE_GB (default 200), except
+frames linked by the current job, frames another job is downloading, and
+frames still hardlinked into pair directories (removing those would free
+no disk). NOTE: symlinks (other filesystems) don't protect a frame, they
+are left dangling once it is evicted
+
+Examples:
+slc_cache.py
+slc_cache.py -q 100
+'''
+import argparse
+import fcntl
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from download_manager import download
+from http_cache import CACHE_DIR, evict_lru, get_session
+
+SLC_CACHE = os.environ.get('DINOSAR_SLC_CACHE', os.path.join(CACHE_DIR, 'slc'))
+SLC_CACHE_GB = float(os.environ.get('DINOSAR_SLC_CACHE_GB', 200))
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='slc_cache.py')
+    parser.add_argument('-q', type=float, dest='quota', required=False,
+            default=SLC_CACHE_GB,
+            help='Evict least recently used frames down to this size [GB]')
+    parser.add_argument('-c', type=str, dest='cachedir', required=False,
+            default=SLC_CACHE,
+            help='Cache directory')
+
+    return parser.parse_args()
+
+
+def cache_path(url, md5=None, cachedir=None):
+    '''
+    Cached location of a frame: cachedir/granule/md5sum/fileName
+    '''
+    fileName = os.path.basename(url)
+    granule = os.path.splitext(fileName)[0]
+    return os.path.join(cachedir or SLC_CACHE, granule, md5 or 'unverified', fileName)
+
+
+def link(src, linkdir='.'):
+    '''
+    Hardlink src into linkdir, symlink if on another filesystem
+    returns link path
+    '''
+    dst = os.path.join(linkdir, os.path.basename(src))
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return dst
+        os.remove(dst)  # stale link or incomplete download
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+    return dst
+
+
+def fetch(url, size=None, md5=None, linkdir='.', cachedir=None, connections=4, session=None):
+    '''
+    Link a frame into linkdir, downloading it into the cache first if needed
+    '''
+    cached = cache_path(url, md5, cachedir)
+    outdir = os.path.dirname(cached)
+    os.makedirs(outdir, exist_ok=True)
+    # NOTE: lock so concurrent jobs wait for one download of the same frame
+    with open(os.path.join(outdir, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isfile(cached):
+            print('Using cached', cached)
+        download(url, outdir, size, md5, connections, session)
+        os.utime(cached)  # mark as recently used
+        return link(cached, linkdir)
+
+
+def fetch_all(jobs, linkdir='.', workers=4, connections=4, cachedir=None, quota=None):
+    '''
+    Link (url, bytes, md5sum) jobs into linkdir through the cache, then
+    evict old frames (not these) down to quota [GB]. returns link paths
+    '''
+    cachedir = cachedir or SLC_CACHE
+    session = get_session(workers * connections)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetch, url, size, md5, linkdir, cachedir, connections, session)
+                   for url, size, md5 in jobs]
+        links = [future.result() for future in futures]
+    keep = [cache_path(url, md5, cachedir) for url, size, md5 in jobs]
+    evict(cachedir, quota, keep)
+    return links
+
+
+def cached_frames(cachedir=None):
+    ''' List of (last used, bytes, path) for complete cached frames '''
+    frames = []
+    for root, dirs, files in os.walk(cachedir or SLC_CACHE):
+        for name in files:
+            if name.startswith('.') or name.endswith(('.part', '.json', '.tmp')):
+                continue  # locks and downloads in progress
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            frames.append((st.st_mtime, st.st_size, path))
+    return frames
+
+
+def evict(cachedir=None, quota=None, keep=[]):
+    '''
+    Remove least recently used frames until cache is below quota [GB]
+    skips frames in keep, locked by a download (fetch), or with other
+    hardlinks. returns remaining bytes
+    '''
+    if quota is None:
+        quota = SLC_CACHE_GB
+    keep = set(os.path.abspath(path) for path in keep)
+    def remove(path):
+        if os.path.abspath(path) in keep:
+            return False
+        return remove_frame(path)
+    return evict_lru(cached_frames(cachedir), quota * 1e9, remove=remove)
+
+
+def remove_frame(path):
+    '''
+    Remove a cached frame unless another job holds its lock (download in
+    progress) or it is still hardlinked into a pair directory. returns
+    False if the frame was kept
+    '''
+    with open(os.path.join(os.path.dirname(path), '.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False  # being downloaded or linked by another job
+        if os.stat(path).st_nlink > 1:
+            return False  # still linked into a pair directory
+        print('Evicting', path)
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    nbytes = evict(args.cachedir, args.quota)
+    print('SLC cache {}: {:.1f} GB'.format(args.cachedir, nbytes / 1e9))
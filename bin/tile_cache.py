@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+'''
+Offline caches for plot_inventory_asf.py map backgrounds
+
+WMTS tiles (e.g. GIBS BlueMarble_ShadedRelief_Bathymetry) are kept in
+$DINOSAR_CACHE/tiles (default ~/.cache/dinosar/tiles), least recently used
+tiles are removed once the cache exceeds $DINOSAR_TILE_CACHE_MB (default 500).
+The WMTS capabilities document goes through http_cache.py. Natural Earth
+coastlines and borders are downloaded by cartopy into
+$DINOSAR_CACHE/natural_earth, which can be seeded ahead of time (-n) for
+machines without internet access
+
+Examples:
+tile_cache.py -n
+tile_cache.py -m 200
+'''
+import argparse
+import hashlib
+import io
+import os
+import threading
+
+import cartopy
+import cartopy.feature as cfeature
+from cartopy.io import shapereader
+from owslib.wmts import WebMapTileService
+
+from http_cache import CACHE_DIR, cached_get, evict_lru, write_atomic
+
+GIBS_URL = 'http://gibs.earthdata.nasa.gov/wmts/epsg4326/best/wmts.cgi'
+TILE_CACHE_MB = float(os.environ.get('DINOSAR_TILE_CACHE_MB', 500))
+# (category, name, resolution) of features drawn by plot_map(), fixed
+# scales so seeding covers every map (cfeature.BORDERS etc. pick by extent)
+NATURAL_EARTH = [('physical', 'coastline', '10m'),
+                 ('cultural', 'admin_1_states_provinces_lines', '110m'),
+                 ('cultural', 'admin_0_boundary_lines_land', '110m')]
+
+
+def cmdLineParse():
+    '''
+    Command line parser.
+    '''
+    parser = argparse.ArgumentParser(description='tile_cache.py')
+    parser.add_argument('-n', action='store_true', default=False, dest='seed', required=False,
+            help='Download Natural Earth features used by plot_inventory_asf.py')
+    parser.add_argument('-m', type=float, dest='maxMB', required=False,
+            default=TILE_CACHE_MB,
+            help='Evict least recently used tiles down to this size [MB]')
+
+    return parser.parse_args()
+
+
+class CachedWMTS(WebMapTileService):
+    '''
+    WebMapTileService with capabilities and tiles cached on disk,
+    pass to cartopy's ax.add_wmts() in place of the service url
+    '''
+    def __init__(self, url=GIBS_URL, maxMB=TILE_CACHE_MB, cachedir=None, ttl=7*24*3600):
+        params = dict(service='WMTS', request='GetCapabilities', version='1.0.0')
+        xml = cached_get(url, params=params, ttl=ttl).content
+        super(CachedWMTS, self).__init__(url, xml=xml)
+        host = hashlib.sha1(url.encode()).hexdigest()[:8]
+        self.tiledir = os.path.join(cachedir or CACHE_DIR, 'tiles', host)
+        self.maxBytes = maxMB * 2**20
+        self.nbytes = None
+        self._lock = threading.Lock()
+
+    def tile_path(self, layer, tilematrixset, tilematrix, row, column):
+        ''' Cache location of a single tile '''
+        return os.path.join(self.tiledir, layer, tilematrixset, str(tilematrix),
+                            '{}_{}'.format(row, column))
+
+    def gettile(self, layer=None, tilematrixset=None, tilematrix=None,
+                row=None, column=None, **kwargs):
+        '''
+        Tile from cache (marked as recently used) or from the server
+        '''
+        path = self.tile_path(layer, tilematrixset, tilematrix, row, column)
+        if os.path.isfile(path):
+            os.utime(path)
+            with open(path, 'rb') as f:
+                return io.BytesIO(f.read())
+
+        tile = super(CachedWMTS, self).gettile(layer=layer, tilematrixset=tilematrixset,
+                                               tilematrix=tilematrix, row=row,
+                                               column=column, **kwargs)
+        data = tile.read()
+        write_atomic(path, data)
+        with self._lock:
+            if self.nbytes is None:
+                self.nbytes = cache_size(self.tiledir)
+            else:
+                self.nbytes += len(data)
+            if self.nbytes > self.maxBytes:
+                self.nbytes = evict(self.tiledir, self.maxBytes, 0.9)
+        return io.BytesIO(data)
+
+
+def cached_tiles(tiledir):
+    ''' List of (last used, bytes, path) for cached tiles '''
+    tiles = []
+    for root, dirs, files in os.walk(tiledir):
+        for name in files:
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            tiles.append((st.st_mtime, st.st_size, path))
+    return tiles
+
+
+def cache_size(tiledir):
+    ''' Total bytes of cached tiles '''
+    return sum(size for used, size, path in cached_tiles(tiledir))
+
+
+def evict(tiledir, maxBytes, fraction=1.0):
+    '''
+    Remove least recently used tiles until total size is below
+    fraction * maxBytes, returns remaining bytes
+    '''
+    return evict_lru(cached_tiles(tiledir), maxBytes, fraction)
+
+
+def use_natural_earth_cache(cachedir=None):
+    '''
+    Point cartopy downloads (coastlines, borders) at the shared cache
+    '''
+    cartopy.config['data_dir'] = os.path.join(cachedir or CACHE_DIR, 'natural_earth')
+
+
+def natural_earth_feature(name, **kwargs):
+    '''
+    Cartopy feature for a NATURAL_EARTH entry at its seeded resolution
+    '''
+    for category, featureName, resolution in NATURAL_EARTH:
+        if featureName == name:
+            return cfeature.NaturalEarthFeature(category, name, resolution, **kwargs)
+    raise KeyError('{} not in NATURAL_EARTH'.format(name))
+
+
+def seed_natural_earth(cachedir=None):
+    '''
+    Download Natural Earth features used by plot_map() into the cache
+    '''
+    use_natural_earth_cache(cachedir)
+    for category, name, resolution in NATURAL_EARTH:
+        path = shapereader.natural_earth(resolution=resolution,
+                                         category=category, name=name)
+        print(path)
+
+
+if __name__ == '__main__':
+    args = cmdLineParse()
+    if args.seed:
+        seed_natural_earth()
+    tiledir = os.path.join(CACHE_DIR, 'tiles')
+    nbytes = evict(tiledir, args.maxMB * 2**20)
+    print('Tile cache {}: {:.1f} MB'.format(tiledir, nbytes / 2**20))